@@ -0,0 +1,92 @@
+"""Stand-in WINE tree for the benchmarks
+
+Builds fake WINE builds under a temporary wine_dir (shell scripts for wine
+and wineserver, an ntdll carrying a version string), fake prefixes under
+prefix_base and a config file pointing at them, so the launcher runs
+end to end without WINE installed.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_WINE = """#!/bin/sh
+[ "$1" = "--version" ] && echo wine-0.0-bench
+exit 0
+"""
+
+CONFIG = """[common]
+prefix_base = {root}/prefixes
+wine_dir = {root}/wine
+wine_lib32 = lib32
+wine_lib64 = lib
+
+[prefix_default]
+log_dest = {log_dest}
+log_level = error
+environment = {{'WINEDEBUG': '-all'}}
+"""
+
+SYSTEM_REG = """WINE REGISTRY Version 2
+;; All keys relative to \\\\Machine
+
+#arch=win64
+
+[Software\\\\Wine] 1580000000
+"Version"="win10"
+"""
+
+
+def make_build(root, name):
+    """Create a fake WINE build, returning its bin directory"""
+    build = os.path.join(root, "wine", name)
+    bindir = os.path.join(build, "bin")
+    os.makedirs(bindir)
+    for name_ in ("wine", "wineserver"):
+        path = os.path.join(bindir, name_)
+        with open(path, "w") as script:
+            script.write(FAKE_WINE)
+        os.chmod(path, 0o755)
+    for lib in ("lib", "lib32"):
+        os.makedirs(os.path.join(build, lib, "wine"))
+        with open(os.path.join(build, lib, "wine", "ntdll.so"), "wb") as ntdll:
+            ntdll.write(b"\x7fELF\x02" + b"\0" * 4096 + b"wine-0.0 (Bench)\0WINEESYNC\0")
+    return bindir
+
+
+def make_prefix(root, name):
+    prefix = os.path.join(root, "prefixes", name)
+    os.makedirs(os.path.join(prefix, "drive_c", "windows", "system32"))
+    with open(os.path.join(prefix, "system.reg"), "w") as reg:
+        reg.write(SYSTEM_REG)
+    return prefix
+
+
+def make_tree(root, builds=1, prefixes=1, log_dest="console"):
+    """Create the fake builds bench, bench1... and prefixes under root, returning the config file"""
+    make_build(root, "bench")
+    for number in range(1, builds):
+        make_build(root, "bench{}".format(number))
+    make_prefix(root, "bench")
+    for number in range(1, prefixes):
+        make_prefix(root, "bench{}".format(number))
+    return write_config(root, log_dest)
+
+
+def write_config(root, log_dest="console"):
+    config_file = os.path.join(root, "winelauncher.conf")
+    with open(config_file, "w") as conf:
+        conf.write(CONFIG.format(root=root, log_dest=log_dest))
+    return config_file
+
+
+def bench_env(root):
+    """Environment running the launcher from this tree, with its caches under root"""
+    env = dict(os.environ)
+    env["XDG_CACHE_HOME"] = os.path.join(root, "cache")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def launcher(config_file, *argv):
+    return [sys.executable, "-m", "winelauncher.main", "-c", config_file] + list(argv)
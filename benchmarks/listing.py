@@ -0,0 +1,52 @@
+"""Build listing benchmark
+
+Measures the latency of winelauncher --list over a wine_dir holding many
+stand-in WINE builds, with a cold build index (every build probed) and a
+warm one.
+
+usage: python benchmarks/listing.py [--builds N] [--runs N]
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+
+from faketree import bench_env, launcher, make_tree
+from startup import timed_run
+
+
+def run(builds, runs):
+    """Time --list, returning the results in milliseconds"""
+    with tempfile.TemporaryDirectory() as root:
+        config_file = make_tree(root, builds=builds)
+        env = bench_env(root)
+        cache = env["XDG_CACHE_HOME"]
+        listing = launcher(config_file, "--list")
+
+        cold = []
+        for _ in range(runs):
+            shutil.rmtree(cache, ignore_errors=True)
+            cold.append(timed_run(listing, env))
+        warm = statistics.median(timed_run(listing, env) for _ in range(runs))
+
+    return {"builds": builds,
+            "cold_ms": round(statistics.median(cold), 1),
+            "warm_ms": round(warm, 1)}
+
+
+def report(results):
+    print("--list, {} builds, cold index: {:.1f} ms".format(results["builds"], results["cold_ms"]))
+    print("--list, {} builds, warm index: {:.1f} ms".format(results["builds"], results["warm_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="winelauncher build listing benchmark")
+    parser.add_argument("--builds", type=int, default=200, help="stand-in builds in wine_dir")
+    parser.add_argument("--runs", type=int, default=5, help="listings to time")
+    opts = parser.parse_args()
+
+    report(run(opts.builds, opts.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Output pump throughput benchmark
+
+Feeds a stand-in WINE process writing debug-channel lines on both stdout and
+stderr through the output pump, comparing the single-threaded selector pump
+with the former pair of readline threads (one log.info call per line), then
+the cost of each log sink: console, file and a journal stand-in.
+
+With --rate the stand-in writes at that many lines per second per stream, as
+a chatty WINE would, and the launcher CPU time per thousand lines is the
+figure to watch; without it, lines are written as fast as they are read.
+
+usage: python benchmarks/pump.py [--lines N] [--line-size BYTES] [--rate LINES]
+"""
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from winelauncher.functions import pump_output  # noqa: E402
+from winelauncher.winedebug import WineDebugFilter  # noqa: E402
+from winelauncher.winelog import (BatchFileHandler, BatchStreamHandler,  # noqa: E402
+                                  QueueSinkHandler, log_lines)
+
+# Stand-in WINE writing the same lines on stdout and stderr, in ticks of 10 ms when rate limited
+WRITER = """import os, sys, time
+lines, line_size, rate = map(int, sys.argv[1:])
+line = "0024:fixme:d3d:wined3d_bench_func "
+line = (line + "x" * max(0, line_size - len(line) - 1) + "\\n").encode()
+batch = max(1, rate // 100) if rate else 4096
+start = time.monotonic()
+written = 0
+while written < lines:
+    count = min(batch, lines - written)
+    os.write(1, line * count)
+    os.write(2, line * count)
+    written += count
+    if rate:
+        delay = start + written / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+"""
+# Queue size of the journal and file sinks, as set with log_queue
+SINK_QUEUE = 1024
+
+
+class JournalStandIn(logging.Handler):
+    """Send every record as a datagram of journal fields, as the systemd JournalHandler does"""
+
+    def __init__(self):
+        super().__init__()
+        self.sender, self.receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.reader = Thread(target=self.drain, daemon=True)
+        self.reader.start()
+
+    def drain(self):
+        while self.receiver.recv(65536):
+            pass
+
+    def emit(self, record):
+        fields = {"MESSAGE": self.format(record),
+                  "PRIORITY": "6",
+                  "LOGGER": record.name,
+                  "THREAD_NAME": record.threadName,
+                  "CODE_FILE": record.pathname,
+                  "CODE_LINE": record.lineno,
+                  "CODE_FUNC": record.funcName,
+                  "SYSLOG_IDENTIFIER": "bench"}
+        fields.update((key, value) for key, value in record.__dict__.items() if key.isupper())
+        self.sender.send("".join("{}={}\n".format(key, value)
+                                 for key, value in fields.items()).encode())
+
+    def close(self):
+        self.sender.send(b"")
+        self.reader.join()
+        self.sender.close()
+        self.receiver.close()
+        super().close()
+
+
+def consume_output(pipe, consume):
+    """Former per-pipe reader thread, kept as the baseline"""
+    with pipe:
+        for line in iter(pipe.readline, b''):
+            consume(line)
+
+
+def spawn(opts):
+    return subprocess.Popen([sys.executable, "-c", WRITER,
+                             str(opts.lines), str(opts.line_size), str(opts.rate)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def bench_threads(opts, log):
+    wine_p = spawn(opts)
+    consume = lambda line: log.info(line.decode('utf-8', 'replace'))
+    threads = [Thread(target=consume_output, args=[wine_p.stdout, consume]),
+               Thread(target=consume_output, args=[wine_p.stderr, consume])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wine_p.wait()
+
+
+def bench_pump(opts, log):
+    wine_p = spawn(opts)
+    with wine_p.stdout, wine_p.stderr:
+        pump_output({'stdout': wine_p.stdout, 'stderr': wine_p.stderr},
+                    lambda stream, lines: log_lines(log, stream, lines))
+    wine_p.wait()
+
+
+def bench_dedup(opts, log):
+    wine_p = spawn(opts)
+    debug_filter = WineDebugFilter()
+
+    def consume(stream, lines):
+        lines, _ = debug_filter.process(lines)
+        log_lines(log, stream, lines)
+
+    with wine_p.stdout, wine_p.stderr:
+        pump_output({'stdout': wine_p.stdout, 'stderr': wine_p.stderr}, consume)
+    log_lines(log, 'stderr', debug_filter.flush()[0])
+    wine_p.wait()
+
+
+def measure(name, bench, opts, log, handler=None):
+    """Run a scenario with an optional sink, closed (hence drained) before the clock stops"""
+    if handler:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s bench %(message)s"))
+        log.addHandler(handler)
+    start = time.perf_counter()
+    cpu = time.process_time()
+    bench(opts, log)
+    if handler:
+        log.removeHandler(handler)
+        handler.close()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    total_lines = 2 * opts.lines
+    result = {"lines_per_s": round(total_lines / elapsed),
+              "cpu_ms_per_1k_lines": round(cpu * 1e6 / total_lines, 2)}
+    print("{:<30} {:>10.0f} lines/s {:>8.2f} ms CPU/1k lines ({:.2f} s)".format(
+        name, result["lines_per_s"], result["cpu_ms_per_1k_lines"], elapsed))
+    return result
+
+
+def run(opts):
+    """Run every scenario, returning their results by name"""
+    log = logging.getLogger("winelauncher.bench")
+    log.propagate = False
+    results = {}
+    with tempfile.TemporaryDirectory() as root, open(os.devnull, "w") as devnull:
+        # Pump cost alone: records are dropped by the level check
+        log.setLevel(logging.WARNING)
+        results["threads_no_sink"] = measure("threads, no sink", bench_threads, opts, log)
+        results["pump_no_sink"] = measure("selector pump, no sink", bench_pump, opts, log)
+
+        log.setLevel(logging.INFO)
+        results["pump_console"] = measure("selector pump, console", bench_pump, opts, log,
+                                          BatchStreamHandler(devnull))
+
+        # Former FileHandler against the batching one, inline and queued
+        results["threads_file"] = measure(
+            "threads, file sink", bench_threads, opts, log,
+            logging.FileHandler(os.path.join(root, "threads.log")))
+        results["pump_file"] = measure(
+            "selector pump, file sink", bench_pump, opts, log,
+            BatchFileHandler(os.path.join(root, "pump.log")))
+        results["pump_file_queued"] = measure(
+            "selector pump, queued file", bench_pump, opts, log,
+            QueueSinkHandler(BatchFileHandler(os.path.join(root, "queued.log")), SINK_QUEUE))
+        results["pump_file_dedup"] = measure(
+            "selector pump, file, dedup", bench_dedup, opts, log,
+            BatchFileHandler(os.path.join(root, "dedup.log")))
+
+        results["pump_journal"] = measure("selector pump, journal", bench_pump, opts, log,
+                                          JournalStandIn())
+        results["pump_journal_queued"] = measure(
+            "selector pump, queued journal", bench_pump, opts, log,
+            QueueSinkHandler(JournalStandIn(), SINK_QUEUE))
+    return results
+
+
+def add_arguments(parser):
+    parser.add_argument("--lines", type=int, default=200000, help="lines per stream")
+    parser.add_argument("--line-size", type=int, default=80, help="bytes per line")
+    parser.add_argument("--rate", type=int, default=0,
+                        help="lines per second per stream, unlimited by default")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="winelauncher output pump benchmark")
+    add_arguments(parser)
+    opts = parser.parse_args()
+
+    results = run(opts)
+    print("pump speedup, no sink:   {:.1f}x".format(
+        results["pump_no_sink"]["lines_per_s"] / results["threads_no_sink"]["lines_per_s"]))
+    print("pump speedup, file sink: {:.1f}x".format(
+        results["pump_file"]["lines_per_s"] / results["threads_file"]["lines_per_s"]))
+
+
+if __name__ == "__main__":
+    main()
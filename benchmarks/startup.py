@@ -0,0 +1,81 @@
+"""Launcher startup benchmark
+
+Measures the import cost of winelauncher.main and the launcher overhead of a
+cold (no launch plan cache) and warm launch, using a stand-in WINE build that
+exits immediately. Exits with status 1 when the warm overhead is over budget.
+
+usage: python benchmarks/startup.py [--runs N] [--budget MS]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from faketree import bench_env, launcher, make_tree
+
+# Warm launcher overhead allowed before Popen, in milliseconds
+STARTUP_BUDGET_MS = 120
+
+
+def timed_run(cmd, env):
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def import_time(env):
+    """Cumulative import time of winelauncher.main, in milliseconds"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import winelauncher.main"],
+                            env=env, stderr=subprocess.PIPE, check=True)
+    for line in result.stderr.decode().splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "winelauncher.main":
+            return int(fields[1]) / 1000.0
+    return None
+
+
+def run(runs):
+    """Time the launches, returning the results in milliseconds"""
+    with tempfile.TemporaryDirectory() as root:
+        config_file = make_tree(root)
+        env = bench_env(root)
+        fake_wine = os.path.join(root, "wine", "bench", "bin", "wine")
+        launch = launcher(config_file, "--prefix", "bench", "--wine-version", "bench", "noop.exe")
+
+        baseline = statistics.median(timed_run([fake_wine, "noop.exe"], env) for _ in range(runs))
+        cold = timed_run(launch, env) - baseline
+        warm = statistics.median(timed_run(launch, env) for _ in range(runs)) - baseline
+        imports = import_time(env)
+
+    return {"import_ms": round(imports or 0, 1),
+            "cold_overhead_ms": round(cold, 1),
+            "warm_overhead_ms": round(warm, 1)}
+
+
+def report(results, budget):
+    print("import winelauncher.main: {:.1f} ms".format(results["import_ms"]))
+    print("cold launch overhead:     {:.1f} ms".format(results["cold_overhead_ms"]))
+    print("warm launch overhead:     {:.1f} ms (budget {:.0f} ms)".format(
+        results["warm_overhead_ms"], budget))
+    if results["warm_overhead_ms"] > budget:
+        print("Warm launch overhead over budget")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="winelauncher startup benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="warm launches to time")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS,
+                        help="warm launcher overhead budget in ms")
+    opts = parser.parse_args()
+
+    if not report(run(opts.runs), opts.budget):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark suite
+
+Runs the startup, build listing and output pump benchmarks against the
+stand-in WINE tree and saves their results as JSON, labelled with the current
+commit, so runs can be compared between commits.
+
+usage: python benchmarks/suite.py [--output FILE] [--compare FILE] [--quick]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import listing
+import pump
+import startup
+
+from faketree import ROOT
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def git_revision():
+    try:
+        result = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return result.stdout.decode().strip()
+
+
+def flatten(results, prefix=""):
+    """Map each figure of nested results to its dotted name"""
+    figures = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            figures.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)):
+            figures[prefix + key] = value
+    return figures
+
+
+def compare(previous, results):
+    """Print the figures of both runs side by side, with the change in percent"""
+    print("")
+    print("{:<50} {:>12} {:>12} {:>8}".format(
+        "", previous["revision"][:12], results["revision"][:12], "change"))
+    before = flatten(previous["benchmarks"])
+    for name, value in sorted(flatten(results["benchmarks"]).items()):
+        old = before.get(name)
+        if old is None:
+            print("{:<50} {:>12} {:>12}".format(name, "-", value))
+        elif old:
+            print("{:<50} {:>12} {:>12} {:>+7.1f}%".format(name, old, value,
+                                                           (value - old) * 100.0 / old))
+        else:
+            print("{:<50} {:>12} {:>12}".format(name, old, value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="winelauncher benchmark suite")
+    parser.add_argument("--output", help="results file, results/<revision>.json by default")
+    parser.add_argument("--compare", metavar="FILE", help="results of an earlier run to compare with")
+    parser.add_argument("--quick", action="store_true", help="fewer runs and lines, for a smoke run")
+    parser.add_argument("--runs", type=int, default=20, help="warm launches to time")
+    parser.add_argument("--budget", type=float, default=startup.STARTUP_BUDGET_MS,
+                        help="warm launcher overhead budget in ms")
+    parser.add_argument("--builds", type=int, default=200, help="stand-in builds to list")
+    pump.add_arguments(parser)
+    opts = parser.parse_args()
+    if opts.quick:
+        opts.runs = 3
+        opts.builds = 20
+        opts.lines = 20000
+
+    print("== startup")
+    startup_results = startup.run(opts.runs)
+    within_budget = startup.report(startup_results, opts.budget)
+    print("== listing")
+    listing_results = listing.run(opts.builds, max(1, opts.runs // 4))
+    listing.report(listing_results)
+    print("== pump")
+    pump_results = pump.run(opts)
+
+    results = {
+        "revision": git_revision(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "options": {"runs": opts.runs, "builds": opts.builds, "lines": opts.lines,
+                    "line_size": opts.line_size, "rate": opts.rate},
+        "benchmarks": {"startup": startup_results,
+                       "listing": listing_results,
+                       "pump": pump_results},
+    }
+    output = opts.output or os.path.join(RESULTS_DIR, results["revision"] + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    print("Results saved to {}".format(output))
+
+    if opts.compare:
+        with open(opts.compare) as previous:
+            compare(json.load(previous), results)
+    if not within_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
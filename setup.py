@@ -104,6 +104,7 @@ setup(
     entry_points={
         'console_scripts': [
             'winelauncher=winelauncher.main:main',
+            'winelauncher-client=winelauncher.client:main',
         ],
     },
 )
@@ -0,0 +1,150 @@
+import os
+import re
+import tempfile
+import unittest
+
+from winelauncher.registry import RegistryFile, escape, split_key, unescape
+
+REGISTRY = (
+    "WINE REGISTRY Version 2\n"
+    ";; All keys relative to \\\\User\\\\S-1-5-21-0-0-0-1000\n"
+    "\n"
+    "#arch=win64\n"
+    "\n"
+    "[Control Panel\\\\Desktop] 1583094240\n"
+    "#time=1d5f00f3a8ab2a0\n"
+    "\"FontSmoothing\"=\"2\"\n"
+    "\"UserPreferencesMask\"=hex:9e,1e,07,80,12,00,00,00\n"
+    "\n"
+    "[Software\\\\Wine] 1583094241\n"
+    "#time=1d5f00f3a8ab2a1\n"
+    "\"Blob\"=hex:01,02,03,04,05,06,07,08,09,0a,0b,0c,0d,0e,0f,10,11,12,13,14,15,16,\\\n"
+    "  17,18,19,1a\n"
+    "\"Version\"=\"win7\"\n"
+    "\n"
+    "[Software\\\\Wine\\\\Fonts] 1583094242\n"
+    "#time=1d5f00f3a8ab2a2\n"
+    "\"Caf\\xe9\"=\"tab\\there\"\n"
+    "@=\"default\"\n"
+)
+
+
+class EscapeTest(unittest.TestCase):
+
+    def assertRoundTrip(self, text, escaped, special='"', end='"'):
+        self.assertEqual(escape(text, special), escaped)
+        self.assertEqual(unescape(escaped + end + "rest", end), (text, "rest"))
+
+    def test_control_characters(self):
+        self.assertRoundTrip("a\tb\nc\x1b", "a\\tb\\nc\\e")
+
+    def test_octal_padded_before_a_digit(self):
+        self.assertRoundTrip("\x01x", "\\1x")
+        self.assertRoundTrip("\x015", "\\0015")
+        self.assertRoundTrip("\x1f7", "\\0377")
+
+    def test_hex_padded_before_a_hex_digit(self):
+        self.assertRoundTrip("ét", "\\xe9t")
+        self.assertRoundTrip("éa", "\\x00e9a")
+        self.assertRoundTrip("€F", "\\x20acF")
+
+    def test_surrogate_pairs(self):
+        self.assertRoundTrip("\U0001f600", "\\xd83d\\xde00")
+
+    def test_special_characters(self):
+        self.assertRoundTrip('say "hi" \\', 'say \\"hi\\" \\\\')
+        self.assertRoundTrip("[key]", "\\[key\\]", "[]", "]")
+
+    def test_unescape_stops_at_end_character(self):
+        self.assertEqual(unescape('name"=dword:00000001\n', '"'), ("name", "=dword:00000001\n"))
+
+
+class SplitKeyTest(unittest.TestCase):
+
+    def test_roots(self):
+        self.assertEqual(split_key("HKLM\\Software\\Wine"), ("system.reg", "Software\\Wine"))
+        self.assertEqual(split_key("HKEY_CURRENT_USER\\Software"), ("user.reg", "Software"))
+        self.assertEqual(split_key("Software\\Wine"), ("user.reg", "Software\\Wine"))
+
+    def test_default_user(self):
+        self.assertEqual(split_key("HKEY_USERS\\.Default\\Software\\Wine"),
+                         ("userdef.reg", "Software\\Wine"))
+        self.assertEqual(split_key("hku\\.DEFAULT\\Control Panel"), ("userdef.reg", "Control Panel"))
+
+    def test_other_users(self):
+        with self.assertRaises(ValueError):
+            split_key("HKEY_USERS\\S-1-5-21-0-0-0-1000\\Software")
+
+
+class RegistryFileTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".reg")
+        with os.fdopen(fd, "w", newline="") as reg_file:
+            reg_file.write(REGISTRY)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def saved(self, registry):
+        registry.save()
+        with open(self.path, newline="") as reg_file:
+            return reg_file.read()
+
+    def test_unmodified_file_saved_byte_for_byte(self):
+        self.assertEqual(self.saved(RegistryFile(self.path)), REGISTRY)
+
+    def test_untouched_sections_kept(self):
+        registry = RegistryFile(self.path)
+        self.assertTrue(registry.set("Software\\Wine\\Fonts", "Café", "new"))
+        text = self.saved(registry)
+        self.assertEqual(text[:text.index("[Software\\\\Wine\\\\Fonts]")],
+                         REGISTRY[:REGISTRY.index("[Software\\\\Wine\\\\Fonts]")])
+        self.assertIn('"Caf\\xe9"="new"\n@="default"\n', text)
+        self.assertNotIn("1583094242", text)
+
+    def test_values_read(self):
+        registry = RegistryFile(self.path)
+        self.assertEqual(registry.get("Software\\Wine", "version"), "win7")
+        self.assertEqual(registry.get("Software\\Wine\\Fonts", "Café"), "tab\there")
+        self.assertEqual(registry.get("Software\\Wine\\Fonts", ""), "default")
+        self.assertIsNone(registry.get("Software\\Missing", "Version"))
+
+    def test_unchanged_value_not_written(self):
+        registry = RegistryFile(self.path)
+        self.assertFalse(registry.set("Software\\Wine", "Version", "win7"))
+        self.assertFalse(registry.modified)
+
+    def test_hex_continuation_lines(self):
+        registry = RegistryFile(self.path)
+        self.assertTrue(registry.set("Software\\Wine", "Version", "win10"))
+        text = self.saved(registry)
+        self.assertIn("\"Blob\"=hex:01,02,03,04,05,06,07,08,09,0a,0b,0c,0d,0e,0f,10,11,12,13,"
+                      "14,15,16,\\\n  17,18,19,1a\n\"Version\"=\"win10\"\n", text)
+
+    def test_hex_value_replaced_with_its_continuation(self):
+        registry = RegistryFile(self.path)
+        self.assertTrue(registry.set("Software\\Wine", "Blob", 1))
+        text = self.saved(registry)
+        self.assertIn('"Blob"=dword:00000001\n"Version"="win7"\n', text)
+        self.assertNotIn("17,18,19,1a", text)
+
+    def test_new_key_inserted(self):
+        registry = RegistryFile(self.path)
+        self.assertTrue(registry.set("Software\\Wine\\Direct3D", "renderer", "vulkan"))
+        text = self.saved(registry)
+        self.assertTrue(text.startswith(REGISTRY + "\n"))
+        self.assertRegex(text[len(REGISTRY):],
+                         re.compile(r'^\n\[Software\\\\Wine\\\\Direct3D\] \d+\n#time=[0-9a-f]+\n'
+                                    r'"renderer"="vulkan"\n$'))
+        self.assertEqual(RegistryFile(self.path).get("software\\wine\\direct3d", "Renderer"),
+                         "vulkan")
+
+    def test_deleting_missing_value_changes_nothing(self):
+        registry = RegistryFile(self.path)
+        self.assertFalse(registry.set("Software\\Missing", "Version", None))
+        self.assertEqual(self.saved(registry), REGISTRY)
+
+
+if __name__ == "__main__":
+    unittest.main()
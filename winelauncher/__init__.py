@@ -0,0 +1,13 @@
+import sys
+
+__all__ = ["Config", "LaunchError", "LaunchHandle"]
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # The API is imported on first use, keeping the launcher and client startup light
+        if name in __all__:
+            from winelauncher import api
+            return getattr(api, name)
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+else:
+    from winelauncher.api import Config, LaunchError, LaunchHandle  # noqa: F401
@@ -0,0 +1,196 @@
+"""Embeddable winelauncher API
+
+Drives launches from a long running Python process, such as an asyncio
+service, without going through the command line:
+
+    config = Config("/etc/winelauncher.conf")
+    launch = await config.launch("mybottle", ["notepad.exe"])
+    async for stream, line in launch.lines():
+        ...
+    status = await launch.wait()
+
+Importing this module reads no file and starts nothing.
+"""
+import logging
+import os
+import threading
+
+from winelauncher.cache import file_signature
+from winelauncher.configsnapshot import CompiledConfig
+from winelauncher.functions import DEFAULT_CONFIG, PUMP_CHUNK_SIZE, Args, lookup
+
+# Output lines read ahead of the consumer of LaunchHandle.lines()
+OUTPUT_QUEUE = 1024
+
+
+class LaunchError(Exception):
+    """A launch could not be resolved or prepared, the reason has been printed"""
+
+
+class Config:
+    """A winelauncher config file, with the launch plans it resolved
+
+    Unlike the command line, a missing config file is not generated: the
+    default config is used instead.
+    """
+
+    def __init__(self, config_file=None, log=None):
+        if config_file is None:
+            from xdg.BaseDirectory import xdg_config_home
+            config_file = xdg_config_home + "/winelauncher.conf"
+        self.config_file = config_file
+        self.log = log or logging.getLogger("winelauncher")
+        self.parser = CompiledConfig(DEFAULT_CONFIG)
+        self.lock = threading.Lock()
+        self.plans = {}
+        self.signature = file_signature(config_file)
+        self.parser.read(config_file)
+
+    def refresh(self):
+        """Read the config file again if it changed, returning whether it did"""
+        with self.lock:
+            signature = file_signature(self.config_file)
+            if signature == self.signature:
+                return False
+            self.parser.reset()
+            self.parser.read(self.config_file)
+            self.signature = signature
+            self.plans.clear()
+            return True
+
+    def section(self, prefix):
+        """Config section of a prefix"""
+        return prefix if self.parser.has_section(prefix) else 'prefix_default'
+
+    def args(self, prefix, wine_version=None, arch=None, command=()):
+        """Launch arguments of a prefix, as the command line would set them"""
+        section = self.section(prefix)
+        args = Args()
+        args.config_file = self.config_file
+        args.prefix = prefix
+        args.prefix_base = self.parser.get('common', 'prefix_base')
+        args.wine_base = self.parser.get('common', 'wine_dir')
+        args.wine_lib32 = self.parser.get('common', 'wine_lib32')
+        args.wine_lib64 = self.parser.get('common', 'wine_lib64')
+        args.wine_version = wine_version
+        args.wine_arch = arch or lookup(self.parser, section, 'wine_arch')
+        args.no_cache = False
+        args.force = False
+        args.winecommand = list(command)
+        return args, section
+
+    def resolve(self, prefix, wine_version=None, arch=None):
+        """Resolve the launch plan of a prefix: WINE build, paths, environment and settings"""
+        from winelauncher.main import launch_environment
+        args, section = self.args(prefix, wine_version, arch)
+        with self.lock:
+            try:
+                return launch_environment(args, section, self.log, {}, self.plans, self.parser)[0]
+            except SystemExit:
+                raise LaunchError("Cannot resolve the launch plan of {}".format(prefix))
+
+    def prepare(self, prefix, command, wine_version=None, arch=None, environ=None):
+        """Build the WINE command, environment and tuning wrapper of a launch"""
+        from winelauncher.main import prepare_launch
+        args, section = self.args(prefix, wine_version, arch, command)
+        with self.lock:
+            try:
+                return prepare_launch(args, section, self.log,
+                                      os.environ if environ is None else environ,
+                                      self.plans, self.parser)
+            except SystemExit:
+                raise LaunchError("Cannot prepare the launch of {} in {}".format(command, prefix))
+
+    async def launch(self, prefix, command, wine_version=None, arch=None, environ=None):
+        """Start WINE in a prefix, returning the handle of the running launch
+
+        The launch is prepared in the default executor, so the event loop is
+        not held up by a wineserver start or a registry update. None is
+        returned when every winetricks verb of the command was already applied.
+        """
+        import asyncio
+        import subprocess
+        # Python 3.6 has no get_running_loop, get_event_loop is the running one in a coroutine
+        loop = (asyncio.get_running_loop() if hasattr(asyncio, "get_running_loop")
+                else asyncio.get_event_loop())
+        wine_exec, wine_env, wrapper = await loop.run_in_executor(
+            None, self.prepare, prefix, command, wine_version, arch, environ)
+        if wine_exec is None:
+            return None
+        process = await asyncio.create_subprocess_exec(
+            *(wrapper + wine_exec), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=wine_env)
+        return LaunchHandle(process, wine_exec, wine_env)
+
+
+class LaunchHandle:
+    """A running WINE launch
+
+    The output must be read through lines(), or left to wait() which
+    discards it, for WINE not to block on full pipes.
+    """
+
+    def __init__(self, process, command, env):
+        self.process = process
+        self.command = command
+        self.env = env
+        self.pid = process.pid
+        self.reading = False
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    async def lines(self):
+        """Yield the (stream, line) output of WINE until it closes both pipes"""
+        import asyncio
+        queue = asyncio.Queue(maxsize=OUTPUT_QUEUE)
+
+        async def read(name, pipe):
+            pending = b''
+            while True:
+                chunk = await pipe.read(PUMP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = pending + chunk if pending else chunk
+                cut = data.rfind(b'\n')
+                if cut < 0:
+                    pending = data
+                    continue
+                pending = data[cut + 1:]
+                for line in data[:cut].decode('utf-8', 'replace').split('\n'):
+                    await queue.put((name, line))
+            if pending:
+                await queue.put((name, pending.decode('utf-8', 'replace')))
+            await queue.put(None)
+
+        self.reading = True
+        readers = [asyncio.ensure_future(read('stdout', self.process.stdout)),
+                   asyncio.ensure_future(read('stderr', self.process.stderr))]
+        try:
+            open_pipes = len(readers)
+            while open_pipes:
+                item = await queue.get()
+                if item is None:
+                    open_pipes -= 1
+                else:
+                    yield item
+        finally:
+            for reader in readers:
+                reader.cancel()
+            self.reading = False
+
+    async def wait(self):
+        """Wait for WINE to exit, returning its exit status"""
+        if not self.reading:
+            async for _ in self.lines():
+                pass
+        return await self.process.wait()
+
+    def terminate(self):
+        """Ask WINE to exit, with SIGTERM"""
+        if self.process.returncode is None:
+            self.process.terminate()
+
+    def kill(self):
+        if self.process.returncode is None:
+            self.process.kill()
@@ -0,0 +1,195 @@
+import fnmatch
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+from winelauncher.cache import cache_dir
+from winelauncher.main import parse_args, resolve_launch, start_launch
+
+
+class Job:
+    """A command to run in one prefix, with its outcome"""
+
+    def __init__(self, number, argv):
+        self.number = number
+        self.argv = argv
+        self.prefix = None
+        self.build = None
+        self.launch = None
+        self.wine_exec = None
+        self.wine_env = None
+        self.wrapper = []
+        self.log_file = None
+        self.status = None
+        self.error = None
+        self.start = None
+        self.end = None
+
+    def summary(self):
+        return {
+            "job": self.number,
+            "argv": self.argv,
+            "prefix": self.prefix,
+            "wine_base": self.build,
+            "status": self.status,
+            "error": self.error,
+            "duration": round(self.end - self.start, 3) if self.end else None,
+            "log": self.log_file,
+        }
+
+
+def read_job_list(path):
+    """Read a job list: one winelauncher command line per line, # starts a comment"""
+    with open(path) as job_list:
+        lines = [line.strip() for line in job_list]
+    return [shlex.split(line) for line in lines if line and not line.startswith("#")]
+
+
+def glob_jobs(args):
+    """One job running args.winecommand in each prefix under prefix_base matching the glob"""
+    try:
+        prefixes = sorted(entry.name for entry in os.scandir(args.prefix_base)
+                          if entry.is_dir() and fnmatch.fnmatch(entry.name, args.batch_glob))
+    except OSError:
+        prefixes = []
+    common = ["--wine-version", args.wine_version] if args.wine_version else []
+    return [["--prefix", prefix] + common + ["--"] + args.winecommand for prefix in prefixes]
+
+
+class BatchScheduler:
+    """Run jobs concurrently, never two in the same prefix
+
+    At most workers jobs run at once, and at most per_build of them with the
+    same WINE build when per_build is set.
+    """
+
+    def __init__(self, jobs, workers, per_build, log):
+        self.pending = list(jobs)
+        self.workers = max(1, workers)
+        self.per_build = per_build
+        self.log = log
+        self.running = set()
+        self.busy_prefixes = set()
+        self.build_counts = {}
+        self.cond = threading.Condition()
+
+    def runnable(self, job):
+        return (job.prefix not in self.busy_prefixes
+                and (not self.per_build or self.build_counts.get(job.build, 0) < self.per_build))
+
+    def run(self):
+        with self.cond:
+            while self.pending or self.running:
+                job = None
+                if len(self.running) < self.workers:
+                    job = next((job for job in self.pending if self.runnable(job)), None)
+                if job is None:
+                    self.cond.wait()
+                    continue
+                self.pending.remove(job)
+                self.running.add(job)
+                self.busy_prefixes.add(job.prefix)
+                self.build_counts[job.build] = self.build_counts.get(job.build, 0) + 1
+                threading.Thread(target=self.run_job, args=[job], daemon=True).start()
+
+    def run_job(self, job):
+        job.start = time.monotonic()
+        self.log.info("Job {} started in {}: {}".format(job.number, job.prefix,
+                                                        job.launch['wine_exec']))
+        try:
+            # Side effects happen when the job runs: wineserver start, registry, launch record
+            job.wine_exec, job.wine_env, job.wrapper = start_launch(self.log, job.launch)
+            if job.wine_exec is None:
+                # Every winetricks verb was already applied
+                job.status = 0
+                return
+            with open(job.log_file, "ab") as output:
+                job.status = subprocess.run(job.wrapper + job.wine_exec,
+                                            stdin=subprocess.DEVNULL,
+                                            stdout=output, stderr=output,
+                                            env=job.wine_env).returncode
+        except Exception as err:
+            # Not only OSError: whatever fails, the job must give its slot back
+            job.error = str(err) or type(err).__name__
+        finally:
+            job.end = time.monotonic()
+            self.log.info("Job {} in {} exited with {} after {:.1f} s".format(
+                job.number, job.prefix, job.status if job.error is None else job.error,
+                job.end - job.start))
+            # The slot is released whatever happened, or the batch would wait for it forever
+            with self.cond:
+                self.running.discard(job)
+                self.busy_prefixes.discard(job.prefix)
+                self.build_counts[job.build] -= 1
+                self.cond.notify()
+
+
+def prepare_jobs(job_argvs, config_file, log_dir, log):
+    """Resolve every job's command and environment, marking the ones that cannot run
+
+    Nothing is done to the prefixes yet, start_launch runs with the job.
+    """
+    jobs = []
+    for number, argv in enumerate(job_argvs, 1):
+        job = Job(number, argv)
+        jobs.append(job)
+        try:
+            args, config_section = parse_args(["-c", config_file] + argv, load=False)
+            if not args.winecommand:
+                job.error = "no command"
+                continue
+            job.launch = resolve_launch(args, config_section, log, os.environ)
+        except SystemExit:
+            job.error = "cannot resolve the launch"
+            continue
+        job.prefix = job.launch['wine_env']['WINEPREFIX']
+        job.build = job.launch['wine_env']['WINEVERPATH']
+        job.log_file = os.path.join(log_dir, "{:04d}-{}.log".format(number, args.prefix or "wine"))
+    return jobs
+
+
+def run_batch(args, log):
+    """Run a batch of jobs and print their summary, returning the exit status"""
+    if args.batch:
+        try:
+            job_argvs = read_job_list(args.batch)
+        except (OSError, ValueError) as err:
+            print("Cannot read job list {}: {}".format(args.batch, err))
+            return 1
+    else:
+        if not args.winecommand:
+            print("--batch-glob needs a command to run")
+            return 1
+        job_argvs = glob_jobs(args)
+
+    log_dir = args.batch_logs or os.path.join(cache_dir(), "batch", time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(log_dir, exist_ok=True)
+    jobs = prepare_jobs(job_argvs, args.config_file, log_dir, log)
+    runnable = [job for job in jobs if job.error is None]
+
+    start = time.monotonic()
+    BatchScheduler(runnable, args.jobs, args.jobs_per_build, log).run()
+    wall_time = time.monotonic() - start
+
+    failed = [job for job in jobs if job.error is not None or job.status != 0]
+    print("{:>5}  {:>7}  {:>9}  {}".format("job", "status", "time", "command"))
+    for job in jobs:
+        summary = job.summary()
+        print("{:>5}  {:>7}  {:>9}  {}".format(
+            job.number,
+            job.status if job.error is None else "error",
+            "{:.1f} s".format(summary["duration"]) if summary["duration"] is not None else "-",
+            " ".join(job.argv)))
+    throughput = len(runnable) / wall_time * 60 if wall_time else 0
+    print("{} jobs, {} failed, {:.1f} s wall time, {:.1f} jobs/min, logs in {}".format(
+        len(jobs), len(failed), wall_time, throughput, log_dir))
+
+    with open(os.path.join(log_dir, "summary.json"), "w") as summary_file:
+        json.dump({"wall_time": round(wall_time, 3),
+                   "jobs_per_minute": round(throughput, 2),
+                   "failed": len(failed),
+                   "jobs": [job.summary() for job in jobs]}, summary_file, indent=2)
+    return 1 if failed else 0
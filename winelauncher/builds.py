@@ -0,0 +1,217 @@
+import mmap
+import os
+import re
+
+from winelauncher.cache import cache_dir, file_signature, read_json, write_json
+
+SYSTEM_PREFIX = "/usr"
+SYSTEM_LIB_DIRS = ["lib", "lib32", "lib64", "lib/x86_64-linux-gnu", "lib/i386-linux-gnu"]
+VERSION_RE = re.compile(rb"wine-\d+\.\d+(?:\.\d+)?(?:-rc\d+)?(?: \([^)\x00\n]{1,64}\))?")
+# ntdll binaries, relative to a lib directory
+NTDLL_SOURCES = [
+    "wine/ntdll.so",
+    "wine/x86_64-unix/ntdll.so",
+    "wine/i386-unix/ntdll.so",
+    "wine/ntdll.dll.so",
+]
+# Binaries carrying the build id string
+VERSION_SOURCES = ["libwine.so.1"] + NTDLL_SOURCES
+# Environment variables read by ntdll builds carrying the esync/fsync patches
+SYNC_VARIABLES = {"esync": b"WINEESYNC", "fsync": b"WINEFSYNC"}
+ELF_CLASS = {1: "32", 2: "64"}
+PE_ARCH_DIRS = {"i386-windows": "32", "x86_64-windows": "64"}
+PROBE_WORKERS = 8
+
+
+def index_path():
+    return os.path.join(cache_dir(), "builds.json")
+
+
+def read_build_version(build_dir, lib_dirs):
+    """Read the WINE build id string from the build's binaries, without running them"""
+    candidates = [os.path.join(build_dir, lib, source)
+                  for lib in lib_dirs for source in VERSION_SOURCES]
+    candidates.append(os.path.join(build_dir, "bin", "wine"))
+    for candidate in candidates:
+        try:
+            with open(candidate, "rb") as binary:
+                with mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    match = VERSION_RE.search(data)
+                    if match:
+                        return match.group(0).decode("utf-8", "replace")
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def detect_sync(build_dir, lib_dirs):
+    """Find the synchronization primitives (esync, fsync) the build's ntdll supports"""
+    found = set()
+    for lib in lib_dirs:
+        for source in NTDLL_SOURCES:
+            try:
+                with open(os.path.join(build_dir, lib, source), "rb") as binary:
+                    with mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        found.update(mode for mode, variable in SYNC_VARIABLES.items()
+                                     if data.find(variable) >= 0)
+            except (OSError, ValueError):
+                continue
+    return sorted(found)
+
+
+def elf_class(path):
+    """Return the bitness of an ELF file, or None if it is not one"""
+    try:
+        with open(path, "rb") as binary:
+            header = binary.read(5)
+    except OSError:
+        return None
+    if header[:4] != b"\x7fELF" or len(header) < 5:
+        return None
+    return ELF_CLASS.get(header[4])
+
+
+def detect_arches(build_dir, lib_dirs):
+    """Detect the architectures a build supports from its lib directories"""
+    arches = set()
+    for lib in lib_dirs:
+        wine_lib = os.path.join(build_dir, lib, "wine")
+        try:
+            entries = list(os.scandir(wine_lib))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name in PE_ARCH_DIRS:
+                arches.add(PE_ARCH_DIRS[entry.name])
+        for name in ("ntdll.dll.so", "ntdll.so"):
+            arch = elf_class(os.path.join(wine_lib, name))
+            if arch:
+                arches.add(arch)
+                break
+        else:
+            for entry in entries:
+                if entry.name.endswith(".so") and entry.is_file():
+                    arch = elf_class(entry.path)
+                    if arch:
+                        arches.add(arch)
+                        break
+    return sorted(arches)
+
+
+def tree_size(path):
+    """Return the apparent size of a directory tree, not following symlinks"""
+    total = 0
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return 0
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    total += tree_size(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return total
+
+
+def probe_build(name, build_dir, lib_dirs, measure_size=True):
+    """Collect the index entry of a single WINE build"""
+    return {
+        "name": name,
+        "path": build_dir,
+        "version": read_build_version(build_dir, lib_dirs),
+        "arches": detect_arches(build_dir, lib_dirs),
+        "sync": detect_sync(build_dir, lib_dirs),
+        "size": tree_size(build_dir) if measure_size else None,
+        "libs": lib_dirs,
+        "loader": file_signature(os.path.join(build_dir, "bin", "wine")),
+    }
+
+
+def is_current(entry, build_dir, lib_dirs):
+    """Check an index entry against the build's loader signature"""
+    return (entry is not None
+            and entry["libs"] == lib_dirs
+            and entry["loader"] == file_signature(os.path.join(build_dir, "bin", "wine")))
+
+
+def scan_builds(wine_base):
+    """Return the names of the directories under wine_base holding a WINE loader"""
+    try:
+        entries = list(os.scandir(wine_base))
+    except OSError:
+        return []
+    # Hidden directories are builds being installed or removed
+    return sorted(entry.name for entry in entries
+                  if entry.is_dir() and not entry.name.startswith(".")
+                  and os.path.isfile(os.path.join(entry.path, "bin", "wine")))
+
+
+def probe_system(entry):
+    """Return the index entry of the system WINE, probing it again if it changed"""
+    if not os.path.isfile(os.path.join(SYSTEM_PREFIX, "bin", "wine")):
+        return None
+    if is_current(entry, SYSTEM_PREFIX, SYSTEM_LIB_DIRS):
+        return entry
+    return probe_build("system", SYSTEM_PREFIX, SYSTEM_LIB_DIRS, measure_size=False)
+
+
+def refresh_index(wine_base, wine_lib32, wine_lib64):
+    """Bring the build index up to date, probing only new or changed builds"""
+    index = read_json(index_path(), {})
+    bases = index.get("bases", {})
+    known = bases.get(wine_base, {})
+    lib_dirs = [wine_lib32, wine_lib64]
+
+    builds = {}
+    stale = []
+    for name in scan_builds(wine_base):
+        build_dir = os.path.join(wine_base, name)
+        if is_current(known.get(name), build_dir, lib_dirs):
+            builds[name] = known[name]
+        else:
+            stale.append((name, build_dir))
+
+    system = probe_system(index.get("system"))
+
+    if stale:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(stale))) as pool:
+            probed = pool.map(lambda build: probe_build(build[0], build[1], lib_dirs), stale)
+            for entry in probed:
+                builds[entry["name"]] = entry
+
+    if stale or builds.keys() != known.keys() or system != index.get("system"):
+        bases[wine_base] = builds
+        write_json(index_path(), {"bases": bases, "system": system})
+    return {"system": system, "builds": builds}
+
+
+def find_build(wine_base, name, wine_lib32, wine_lib64, reprobe=False):
+    """Return the index entry of a single build, probing it only if it changed or reprobe is set"""
+    build_dir = os.path.join(wine_base, name)
+    if not os.path.isfile(os.path.join(build_dir, "bin", "wine")):
+        return None
+    lib_dirs = [wine_lib32, wine_lib64]
+    index = read_json(index_path(), {})
+    bases = index.get("bases", {})
+    entry = bases.get(wine_base, {}).get(name)
+    if reprobe or not is_current(entry, build_dir, lib_dirs):
+        entry = probe_build(name, build_dir, lib_dirs)
+        bases.setdefault(wine_base, {})[name] = entry
+        index["bases"] = bases
+        write_json(index_path(), index)
+    return entry
+
+
+def find_system_build():
+    """Return the index entry of the system WINE, None if there is none"""
+    index = read_json(index_path(), {})
+    entry = probe_system(index.get("system"))
+    if entry != index.get("system"):
+        index["system"] = entry
+        write_json(index_path(), index)
+    return entry
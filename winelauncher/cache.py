@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import time
+
+CACHE_VERSION = 2
+PLAN_CACHE_SIZE = 64
+
+
+def cache_dir():
+    """Return the winelauncher cache directory, creating it if needed"""
+    from xdg.BaseDirectory import xdg_cache_home
+    path = os.path.join(xdg_cache_home, "winelauncher")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_signature(path):
+    """Return a (mtime, inode, size) tuple identifying a file's current state"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_ino, st.st_size]
+
+
+def read_json(path, default=None):
+    """Load a JSON cache file, returning default if missing or unreadable"""
+    try:
+        with open(path, encoding="utf-8") as cache_file:
+            data = json.load(cache_file)
+    except (OSError, ValueError):
+        return default
+    if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+        return default
+    return data
+
+
+def write_json(path, data):
+    """Atomically replace a JSON cache file"""
+    data["version"] = CACHE_VERSION
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), id(data))
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+            json.dump(data, tmp_file, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as err:
+        print("Cannot write cache file {}".format(path))
+        print("OSError: {0}".format(err))
+
+
+def plan_key(config_file, args):
+    """Build the cache key of a launch plan from everything that can change it"""
+    key = [
+        file_signature(config_file),
+        os.path.abspath(config_file),
+        args.prefix,
+        args.prefix_base,
+        args.wine_base,
+        args.wine_lib32,
+        args.wine_lib64,
+        args.wine_version,
+        args.wine_arch,
+    ]
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def load_plan(key):
+    """Return the cached launch plan for key, if still valid"""
+    plans = read_json(os.path.join(cache_dir(), "launch-plans.json"), {})
+    entry = plans.get("plans", {}).get(key)
+    if not entry:
+        return None
+    # The WINE build may have been replaced or removed since it was probed
+    if file_signature(entry["plan"]["loader"]) != entry["loader"]:
+        return None
+    return entry["plan"]
+
+
+def save_plan(key, plan):
+    """Store a resolved launch plan, dropping the least recently saved ones"""
+    path = os.path.join(cache_dir(), "launch-plans.json")
+    plans = read_json(path, {}).get("plans", {})
+    plans[key] = {
+        "loader": file_signature(plan["loader"]),
+        "saved": time.time(),
+        "plan": plan,
+    }
+    if len(plans) > PLAN_CACHE_SIZE:
+        oldest = sorted(plans, key=lambda k: plans[k]["saved"])
+        for old_key in oldest[:len(plans) - PLAN_CACHE_SIZE]:
+            del plans[old_key]
+    write_json(path, {"plans": plans})
+
+
+def launch_record_path(prefix):
+    """Per-prefix record of the last launch, one file each so concurrent launches don't race"""
+    name = hashlib.sha1(os.path.abspath(prefix).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), "launches", name + ".json")
+
+
+def record_launch(prefix, wine_base):
+    """Remember the WINE build and time of the latest launch in a prefix"""
+    path = launch_record_path(prefix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json(path, {"prefix": prefix, "wine_base": wine_base, "time": time.time()})
+
+
+def last_launch(prefix):
+    return read_json(launch_record_path(prefix))
@@ -0,0 +1,106 @@
+"""winelauncher-client: run a launch through the winelauncher daemon
+
+Takes the same arguments as winelauncher. The command line, working
+directory, environment and standard streams are handed to the daemon
+started with `winelauncher --daemon`; when no daemon is listening, or it
+cannot serve the request, the regular launcher runs instead.
+"""
+import array
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+
+
+def socket_path():
+    """Path of the daemon socket"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "winelauncher.sock")
+    return "/tmp/winelauncher-{}.sock".format(os.getuid())
+
+
+def peer_uid(sock):
+    """User id of the process at the other end of a Unix socket"""
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def send_message(sock, message, fds=()):
+    """Send a length prefixed JSON message, optionally passing file descriptors"""
+    data = json.dumps(message).encode("utf-8")
+    ancillary = []
+    if fds:
+        ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds)))
+    sock.sendmsg([struct.pack("!I", len(data)) + data], ancillary)
+
+
+def recv_message(sock, max_fds=0):
+    """Receive a message sent by send_message, returning it with the passed descriptors"""
+    fds = array.array("i")
+    header = b""
+    while len(header) < 4:
+        data, ancillary, _, _ = sock.recvmsg(4 - len(header),
+                                             socket.CMSG_SPACE(max_fds * fds.itemsize))
+        for level, kind, fd_data in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(fd_data[:len(fd_data) - len(fd_data) % fds.itemsize])
+        if not data:
+            return None, list(fds)
+        header += data
+    length = struct.unpack("!I", header)[0]
+    body = b""
+    while len(body) < length:
+        data = sock.recv(length - len(body))
+        if not data:
+            return None, list(fds)
+        body += data
+    return json.loads(body.decode("utf-8")), list(fds)
+
+
+def fallback(argv):
+    """Run the regular launcher in place of the client"""
+    os.execvp(sys.executable, [sys.executable, "-m", "winelauncher.main"] + argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+        # Without XDG_RUNTIME_DIR the socket is in /tmp, where another user may listen first
+        if peer_uid(sock) != os.getuid():
+            raise ConnectionRefusedError("daemon socket owned by another user")
+        send_message(sock, {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)},
+                     [0, 1, 2])
+        reply, _ = recv_message(sock)
+    except OSError:
+        reply = None
+    if not reply or reply.get("event") != "started":
+        sock.close()
+        fallback(argv)
+
+    if os.environ.get("WINELAUNCHER_LATENCY"):
+        print("winelauncher-client: launched in {:.1f} ms".format(reply["latency_ms"]),
+              file=sys.stderr)
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, lambda signum, frame: send_message(sock, {"signal": signum}))
+
+    while True:
+        try:
+            reply, _ = recv_message(sock)
+        except InterruptedError:
+            continue
+        if reply is None:
+            sys.exit(1)
+        if reply.get("event") == "exit":
+            status = reply["status"]
+            sys.exit(128 - status if status < 0 else status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import configparser
+import hashlib
+import json
+import os
+import sys
+
+from winelauncher.cache import file_signature, read_json, write_json
+
+# Sections every prefix section inherits from, after its extends chain
+BASE_SECTION = "prefix_default"
+# Bumped when compile_sections resolves differently, outdating the snapshots
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_path(config_file):
+    """Compiled snapshot of a config file, kept next to it"""
+    directory, name = os.path.split(os.path.abspath(config_file))
+    return os.path.join(directory, "." + name + ".snapshot")
+
+
+def parse_environment(section, value):
+    """Parse an environment option, a dict literal of variables, None unsetting one"""
+    from ast import literal_eval
+    try:
+        environment = literal_eval(value)
+    except (SyntaxError, ValueError):
+        environment = None
+    if not isinstance(environment, dict):
+        print("Invalid environment value for {}: expected a dict".format(section))
+        sys.exit(1)
+    return {str(name): None if value is None else str(value)
+            for name, value in environment.items()}
+
+
+def section_chain(parser, section):
+    """Sections an option of section is looked up in, nearest first"""
+    chain = [section]
+    while section != BASE_SECTION:
+        parent = parser._sections[section].get("extends", BASE_SECTION)
+        if parent not in parser._sections:
+            print("Invalid extends value for {}: no section {}".format(section, parent))
+            sys.exit(1)
+        if parent in chain:
+            print("Invalid extends value for {}: {} is extended in a loop".format(chain[0], parent))
+            sys.exit(1)
+        chain.append(parent)
+        section = parent
+    return chain
+
+
+def compile_sections(parser):
+    """Resolve every prefix section into the complete set of options it sees
+
+    An option comes from the section itself, then the sections it extends,
+    then [common] and last [prefix_default]; [prefix_default] itself has its
+    own options first, then [common]. Environment dicts are merged along the
+    same chain instead of replaced, a variable set to None is dropped.
+    """
+    common = {option: parser.get(parser.default_section, option) for option in parser.defaults()}
+    own = {section: {option: parser.get(section, option) for option in parser._sections[section]}
+           for section in parser._sections}
+    # Each environment literal is parsed once, however many sections inherit it
+    environments = {section: parse_environment(section, options["environment"])
+                    for section, options in own.items() if options.get("environment")}
+    if common.get("environment"):
+        environments[parser.default_section] = parse_environment("common", common["environment"])
+
+    sections = {}
+    for section in own:
+        # Farthest first, each section overriding the ones before it
+        if section == BASE_SECTION:
+            chain = [parser.default_section, BASE_SECTION]
+        else:
+            chain = [BASE_SECTION, parser.default_section]
+            chain.extend(reversed(section_chain(parser, section)[:-1]))
+        options = {}
+        environment = {}
+        for name in chain:
+            options.update(own.get(name, common))
+            environment.update(environments.get(name, {}))
+        options.pop("extends", None)
+        options["environment"] = {name: value for name, value in environment.items()
+                                  if value is not None}
+        sections[section] = options
+    return common, sections
+
+
+class CompiledConfig(configparser.ConfigParser):
+    """ConfigParser resolving every prefix section once, on loading
+
+    The resolved sections are saved to a snapshot next to the config file and
+    reused, without parsing the file, until the file or the defaults change;
+    looking an option up is then a single dict lookup.
+    """
+
+    def __init__(self, default_config):
+        super().__init__(default_section="common")
+        self.default_config = default_config
+        self.defaults_key = hashlib.sha1(
+            json.dumps(default_config, sort_keys=True).encode("utf-8")).hexdigest()
+        self.reset()
+
+    def reset(self):
+        """Drop everything read, back to the default config"""
+        for section in self.sections():
+            self.remove_section(section)
+        self.defaults().clear()
+        self.read_dict(self.default_config)
+        self.common, self.resolved = compile_sections(self)
+
+    def read(self, config_file, encoding=None):
+        """Load the config file over the defaults, from its snapshot when up to date"""
+        path = snapshot_path(config_file)
+        source = [file_signature(config_file), self.defaults_key, SNAPSHOT_VERSION]
+        snapshot = read_json(path)
+        if snapshot and snapshot["source"] == source and source[0]:
+            self.read_dict({"common": snapshot["defaults"]}, source=path)
+            self.common, self.resolved = snapshot["common"], snapshot["sections"]
+            return [config_file]
+
+        read_ok = super().read(config_file, encoding)
+        self.common, self.resolved = compile_sections(self)
+        if read_ok and os.access(os.path.dirname(path), os.W_OK):
+            write_json(path, {"source": source,
+                              "defaults": dict(self._defaults),
+                              "common": self.common,
+                              "sections": self.resolved})
+        return read_ok
+
+    def has_section(self, section):
+        return section in self.resolved
+
+    def section(self, section):
+        """Resolved options of a prefix section, prefix_default for unknown ones"""
+        return self.resolved.get(section) or self.resolved[BASE_SECTION]
@@ -0,0 +1,197 @@
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+from winelauncher.cache import file_signature
+from winelauncher.client import peer_uid, recv_message, send_message, socket_path
+from winelauncher.functions import pump_output, reload_config
+from winelauncher.main import debug_output_filter, parse_args, prepare_launch, supervised_features
+
+
+class LaunchServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve console launches with the config and launch plans kept in memory"""
+    daemon_threads = True
+
+    def __init__(self, path, config_file, log):
+        self.config_file = config_file
+        self.config_signature = file_signature(config_file)
+        self.log = log
+        self.lock = threading.Lock()
+        self.plans = {}
+        super().__init__(path, LaunchHandler)
+
+    def verify_request(self, request, client_address):
+        """Only serve the user running the daemon, the socket may be in a shared directory"""
+        uid = peer_uid(request)
+        if uid != os.getuid():
+            self.log.warning("Refusing a launch request from uid {}".format(uid))
+            return False
+        return True
+
+    def refresh_config(self):
+        """Read the config file again if it changed since the last request"""
+        signature = file_signature(self.config_file)
+        if signature != self.config_signature:
+            self.log.info("Config file {} changed, reloading".format(self.config_file))
+            reload_config(self.config_file)
+            self.config_signature = signature
+            self.plans.clear()
+
+    def prepare(self, request):
+        """Build the WINE command, environment, tuning wrapper and debug output filter of a request
+
+        None is returned when the request must run in the regular launcher.
+        """
+        with self.lock:
+            self.refresh_config()
+            try:
+                args, config_section = parse_args(request["argv"], load=False)
+                if (args.config_file != self.config_file or args.daemon or args.list
+                        or not args.winecommand or args.log_output != 'console'):
+                    return None
+                features = supervised_features(config_section, args.winecommand)
+                if features:
+                    self.log.debug("Launching {} locally for {}".format(
+                        args.winecommand, ", ".join(features)))
+                    return None
+                launch = prepare_launch(args, config_section, self.log, request["env"], self.plans)
+                # Nothing to run is reported by the regular launcher
+                if not launch[0]:
+                    return None
+                return launch + (debug_output_filter(config_section),)
+            except SystemExit:
+                return None
+
+
+class LaunchHandler(socketserver.BaseRequestHandler):
+    """Spawn the requested command on the client's standard streams and report its exit
+
+    With a debug output filter, WINE writes to pipes and the filtered lines
+    are relayed to the client's stdout and stderr.
+    """
+
+    def handle(self):
+        start = time.monotonic()
+        request, fds = recv_message(self.request, 3)
+        relayed = []
+        try:
+            launch = self.server.prepare(request) if request and len(fds) == 3 else None
+            if launch is None:
+                send_message(self.request, {"event": "fallback"})
+                return
+            wine_exec, wine_env, wrapper, debug_filter = launch
+            if debug_filter:
+                relayed = fds[1:]
+            wine_p = subprocess.Popen(
+                wrapper + wine_exec,
+                stdin=fds[0],
+                stdout=subprocess.PIPE if relayed else fds[1],
+                stderr=subprocess.PIPE if relayed else fds[2],
+                cwd=request["cwd"],
+                env=wine_env)
+        except OSError as err:
+            self.server.log.error("Cannot launch {}: {}".format(request["argv"], err))
+            send_message(self.request, {"event": "fallback"})
+            relayed = []
+            return
+        finally:
+            for fd in fds:
+                if fd not in relayed:
+                    os.close(fd)
+
+        latency = (time.monotonic() - start) * 1000
+        self.server.log.info("Launched {} (pid {}) in {:.1f} ms".format(
+            wine_exec, wine_p.pid, latency))
+        relay = None
+        if relayed:
+            relay = threading.Thread(target=self.relay_output,
+                                     args=[wine_p, debug_filter, relayed], daemon=True)
+            relay.start()
+        send_message(self.request, {"event": "started", "pid": wine_p.pid, "latency_ms": latency})
+        threading.Thread(target=self.forward_signals, args=[wine_p], daemon=True).start()
+        status = wine_p.wait()
+        if relay:
+            relay.join()
+        try:
+            send_message(self.request, {"event": "exit", "status": status})
+        except OSError:
+            pass
+
+    def relay_output(self, wine_p, debug_filter, fds):
+        """Filter the WINE output and write it to the client's stdout and stderr"""
+        outputs = {'stdout': fds[0], 'stderr': fds[1]}
+        closed = set()
+
+        def write(stream, lines):
+            # Keep reading when the client's terminal is gone, WINE must not block on a full pipe
+            if not lines or stream in closed:
+                return
+            data = "".join(line + "\n" for line in lines).encode('utf-8', 'replace')
+            try:
+                while data:
+                    data = data[os.write(outputs[stream], data):]
+            except OSError:
+                closed.add(stream)
+
+        def consume(stream, lines):
+            write(stream, debug_filter.process(lines)[0])
+
+        try:
+            pump_output({'stdout': wine_p.stdout, 'stderr': wine_p.stderr}, consume)
+            write('stderr', debug_filter.flush()[0])
+        finally:
+            wine_p.stdout.close()
+            wine_p.stderr.close()
+            for fd in fds:
+                os.close(fd)
+
+    def forward_signals(self, wine_p):
+        """Deliver the signals received by the client to the WINE process"""
+        while wine_p.poll() is None:
+            try:
+                message, _ = recv_message(self.request)
+            except OSError:
+                return
+            if message is None:
+                return
+            if "signal" in message and wine_p.poll() is None:
+                wine_p.send_signal(message["signal"])
+
+
+def serve(args, log):
+    """Run the launch daemon until interrupted"""
+    path = socket_path()
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        print("A winelauncher daemon is already listening on {}".format(path))
+        sys.exit(1)
+    except OSError:
+        if os.path.lexists(path):
+            try:
+                os.unlink(path)
+            except OSError as err:
+                print("Cannot remove the stale socket {}: {}".format(path, err))
+                sys.exit(1)
+    finally:
+        probe.close()
+
+    old_umask = os.umask(0o077)
+    try:
+        server = LaunchServer(path, args.config_file, log)
+    finally:
+        os.umask(old_umask)
+    log.info("Serving launches on {} with config {}".format(path, args.config_file))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
@@ -0,0 +1,272 @@
+import hashlib
+import os
+import stat
+import time
+
+from winelauncher.cache import cache_dir, read_json, write_json
+from winelauncher.fileops import reflink, reflink_supported
+from winelauncher.prefixes import is_shareable
+from winelauncher.wineserver import server_running
+
+HASH_CHUNK_SIZE = 1 << 20
+SCAN_WORKERS = 8
+FONT_DIR = "drive_c/windows/fonts"
+FONT_EXTENSIONS = (".ttf", ".ttc", ".otf", ".fon")
+# Markers wine writes after the DOS header of its own DLLs, native ones have neither
+BUILTIN_MARKERS = (b"Wine builtin DLL", b"Wine placeholder DLL")
+
+
+def index_path():
+    return os.path.join(cache_dir(), "dedup-index.json")
+
+
+def is_immutable(relpath):
+    """Whether wine leaves a prefix file alone once installed, so it may be shared"""
+    if is_shareable(relpath):
+        return True
+    return relpath.lower().startswith(FONT_DIR) and relpath.lower().endswith(FONT_EXTENSIONS)
+
+
+def is_wine_builtin(path):
+    """Whether a DLL or executable was installed by wine itself, not by winetricks or an app"""
+    try:
+        with open(path, "rb") as binary:
+            header = binary.read(0x80)
+    except OSError:
+        return False
+    return any(marker in header for marker in BUILTIN_MARKERS)
+
+
+def is_hardlinkable(prefix, path):
+    """Whether a prefix file may be hardlinked: a wine builtin of system32/syswow64
+
+    Fonts and native DLLs are left out, winetricks overwrites them in place.
+    """
+    return is_shareable(os.path.relpath(path, prefix)) and is_wine_builtin(path)
+
+
+def scan_prefix(prefix):
+    """List the shareable files of a prefix as (path, size, mtime_ns, dev, ino) tuples"""
+    found = []
+    pending = [prefix]
+    while pending:
+        path = pending.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif (entry.is_file(follow_symlinks=False)
+                          and is_immutable(os.path.relpath(entry.path, prefix))):
+                        st = entry.stat(follow_symlinks=False)
+                        found.append((entry.path, st.st_size, st.st_mtime_ns,
+                                      st.st_dev, st.st_ino))
+                except OSError:
+                    continue
+    return found
+
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as data:
+        for chunk in iter(lambda: data.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Deduplicator:
+    """Find the identical shareable files of the prefixes and make them share storage
+
+    Files are hashed only when another file has the same size, and hashes
+    are kept in a persistent index keyed on path, size and mtime. Files are
+    shared with reflinks; without them, wine builtins are hardlinked and made
+    read-only when hardlinks are allowed, the other files are only counted.
+    """
+
+    def __init__(self, prefixes, log, dry_run=False, hardlinks=False):
+        self.prefixes = prefixes
+        self.log = log
+        self.dry_run = dry_run
+        self.hardlinks = hardlinks
+        self.index = read_json(index_path(), {}).get("files", {})
+        self.files = 0
+        self.scanned_bytes = 0
+        self.hashed_bytes = 0
+        self.reclaimable = 0
+        self.reclaimed = 0
+        self.groups = 0
+        # Duplicates left alone: wine builtins without --dedup-hardlinks, other files
+        self.hardlink_only = {"builtin": 0, "other": 0}
+        self.hardlink_only_files = {"builtin": 0, "other": 0}
+        self.shared_files = {"reflink": 0, "hardlink": 0}
+
+    def digest(self, path, size, mtime_ns):
+        """Content hash of a file and whether it was computed, from the index if unchanged"""
+        entry = self.index.get(path)
+        if entry and entry[0] == size and entry[1] == mtime_ns:
+            return entry[2], False
+        return hash_file(path), True
+
+    def hashed(self, file):
+        """file with its digest, or None when it cannot be read"""
+        try:
+            return file, self.digest(file[0], file[1], file[2])
+        except OSError as err:
+            self.log.warning("Cannot hash {}: {}".format(file[0], err))
+            return None
+
+    def is_shared(self, keeper, path):
+        """Whether path was already cloned from keeper and left unchanged since"""
+        entry = self.index.get(path)
+        return entry is not None and len(entry) > 3 and entry[3] == keeper
+
+    def prefix_of(self, path):
+        for prefix in self.prefixes:
+            if path.startswith(prefix + os.sep):
+                return prefix
+        return None
+
+    def can_reflink(self, directory):
+        """Whether files of directory can be reflinked
+
+        A dry run leaves the prefixes untouched, so it probes in the cache
+        directory when it is on the same filesystem, and otherwise assumes no
+        reflinks.
+        """
+        if not self.dry_run:
+            return reflink_supported(directory)
+        probe_dir = cache_dir()
+        if os.stat(probe_dir).st_dev != os.stat(directory).st_dev:
+            return False
+        return reflink_supported(probe_dir)
+
+    def sharing(self, keeper, path):
+        """How path may share the storage of keeper: reflink, hardlink, or None"""
+        if self.can_reflink(os.path.dirname(keeper)):
+            return "reflink"
+        if (is_hardlinkable(self.prefix_of(keeper), keeper)
+                and is_hardlinkable(self.prefix_of(path), path)):
+            return "hardlink"
+        return None
+
+    def share(self, keeper, duplicate, method):
+        """Replace duplicate with a reflink or a read-only hardlink of keeper"""
+        if method == "hardlink":
+            mode = os.stat(keeper).st_mode
+            if mode & 0o222:
+                os.chmod(keeper, stat.S_IMODE(mode) & ~0o222)
+        tmp_path = "{}.{}.dedup".format(duplicate, os.getpid())
+        if method == "hardlink":
+            os.link(keeper, tmp_path)
+        elif not reflink(keeper, tmp_path):
+            return
+        os.replace(tmp_path, duplicate)
+        st = os.stat(duplicate)
+        self.index[duplicate] = [st.st_size, st.st_mtime_ns, self.index[keeper][2], keeper]
+        self.reclaimed += st.st_size
+        self.shared_files[method] += 1
+
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+            scanned = list(pool.map(scan_prefix, self.prefixes))
+
+            by_size = {}
+            for files in scanned:
+                for path, size, mtime_ns, dev, ino in files:
+                    self.files += 1
+                    self.scanned_bytes += size
+                    if size:
+                        by_size.setdefault((dev, size), []).append((path, size, mtime_ns, ino))
+            candidates = [file for files in by_size.values() if len(files) > 1 for file in files]
+            digests = [hashed for hashed in pool.map(self.hashed, candidates) if hashed]
+            by_digest = {}
+            for (path, size, mtime_ns, ino), (digest, hashed) in digests:
+                if hashed:
+                    self.hashed_bytes += size
+                    self.index[path] = [size, mtime_ns, digest]
+                by_digest.setdefault(digest, []).append((path, size, ino))
+
+        for files in by_digest.values():
+            if len(files) < 2:
+                continue
+            self.groups += 1
+            files.sort()
+            keeper, size, keeper_ino = files[0]
+            inodes = {keeper_ino}
+            for path, size, ino in files[1:]:
+                # Already a hardlink of the keeper, or cloned from it by an earlier run
+                if ino in inodes or self.is_shared(keeper, path):
+                    continue
+                try:
+                    method = self.sharing(keeper, path)
+                    if method != "reflink" and not (method == "hardlink" and self.hardlinks):
+                        kind = "builtin" if method == "hardlink" else "other"
+                        self.hardlink_only[kind] += size
+                        self.hardlink_only_files[kind] += 1
+                        continue
+                    self.reclaimable += size
+                    if not self.dry_run:
+                        self.share(keeper, path, method)
+                except OSError as err:
+                    self.log.warning("Cannot deduplicate {}: {}".format(path, err))
+        for path in [path for path in self.index if not os.path.exists(path)]:
+            del self.index[path]
+        write_json(index_path(), {"files": self.index})
+
+
+def prefix_dirs(prefix_base):
+    """Prefixes under prefix_base, including the templates"""
+    prefixes = []
+    for base in (prefix_base, os.path.join(prefix_base, ".templates")):
+        try:
+            entries = list(os.scandir(base))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir() and os.path.isfile(os.path.join(entry.path, "system.reg")):
+                prefixes.append(entry.path)
+    return sorted(prefixes)
+
+
+def run_dedup(args, log):
+    """Deduplicate the prefixes under prefix_base and print the report"""
+    prefixes = []
+    for prefix in prefix_dirs(args.prefix_base):
+        if server_running(prefix):
+            print("Skipping {}, its wineserver is running".format(prefix))
+        else:
+            prefixes.append(prefix)
+
+    start = time.monotonic()
+    dedup = Deduplicator(prefixes, log, args.dry_run, args.dedup_hardlinks)
+    dedup.run()
+    elapsed = time.monotonic() - start
+
+    mib = 1024 * 1024
+    print("Scanned {} files ({:.1f} MiB) in {} prefixes, hashed {:.1f} MiB in {:.2f} s "
+          "({:.1f} MiB/s, {:.0f} files/s)".format(
+              dedup.files, dedup.scanned_bytes / mib, len(prefixes), dedup.hashed_bytes / mib,
+              elapsed, dedup.scanned_bytes / mib / elapsed if elapsed else 0,
+              dedup.files / elapsed if elapsed else 0))
+    if args.dry_run:
+        print("{} groups of identical files, {:.1f} MiB reclaimable".format(
+            dedup.groups, dedup.reclaimable / mib))
+    else:
+        print("{} groups of identical files, {:.1f} MiB reclaimed: {} files reflinked, "
+              "{} hardlinked".format(dedup.groups, dedup.reclaimed / mib,
+                                      dedup.shared_files["reflink"],
+                                      dedup.shared_files["hardlink"]))
+    if dedup.hardlink_only_files["builtin"]:
+        print("{} wine builtin DLLs ({:.1f} MiB) could only be hardlinked, the filesystem has "
+              "no reflinks: pass --dedup-hardlinks to share them read-only".format(
+                  dedup.hardlink_only_files["builtin"], dedup.hardlink_only["builtin"] / mib))
+    if dedup.hardlink_only_files["other"]:
+        print("{} fonts and native DLLs ({:.1f} MiB) left unshared, the filesystem has no "
+              "reflinks and winetricks may rewrite them".format(
+                  dedup.hardlink_only_files["other"], dedup.hardlink_only["other"] / mib))
+    return 0
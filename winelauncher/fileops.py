@@ -0,0 +1,83 @@
+import errno
+import fcntl
+import os
+import shutil
+import tempfile
+
+# ioctl cloning a whole file, from linux/fs.h
+FICLONE = 0x40049409
+# Errors meaning the filesystem or the pair of files cannot share extents
+REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS)
+# Whether each filesystem, by st_dev, supports reflinks
+_reflink_devices = {}
+
+
+def reflink(src, dst):
+    """Clone src to a new dst sharing its extents, False if the filesystem can't"""
+    with open(src, "rb") as src_file:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_file.fileno())
+        except OSError as err:
+            os.close(dst_fd)
+            os.unlink(dst)
+            if err.errno in REFLINK_UNSUPPORTED:
+                return False
+            raise
+        os.close(dst_fd)
+    shutil.copystat(src, dst)
+    return True
+
+
+def reflink_supported(directory):
+    """Whether the filesystem of directory can clone files, probed once per filesystem"""
+    dev = os.stat(directory).st_dev
+    if dev not in _reflink_devices:
+        fd, src = tempfile.mkstemp(prefix=".reflink-", dir=directory)
+        try:
+            os.write(fd, b"winelauncher")
+            os.close(fd)
+            dst = src + ".clone"
+            _reflink_devices[dev] = reflink(src, dst)
+            if _reflink_devices[dev]:
+                os.unlink(dst)
+        finally:
+            os.unlink(src)
+    return _reflink_devices[dev]
+
+
+class Cloner:
+    """Clone files with reflinks when possible, else hardlinks when allowed, else copies
+
+    Keeps the number of bytes handled each way, and stops trying reflinks
+    after the first refusal.
+    """
+
+    def __init__(self, hardlinks=False):
+        self.hardlinks = hardlinks
+        self.try_reflink = True
+        self.bytes = {"reflink": 0, "hardlink": 0, "copy": 0}
+        self.files = {"reflink": 0, "hardlink": 0, "copy": 0}
+
+    def clone(self, src, dst, shareable=False):
+        """Clone src to dst, shareable files may be hardlinked; returns the method used"""
+        size = os.lstat(src).st_size
+        if self.try_reflink:
+            if reflink(src, dst):
+                method = "reflink"
+            else:
+                self.try_reflink = False
+        if not os.path.lexists(dst):
+            if self.hardlinks and shareable:
+                try:
+                    os.link(src, dst)
+                    method = "hardlink"
+                except OSError:
+                    shutil.copy2(src, dst)
+                    method = "copy"
+            else:
+                shutil.copy2(src, dst)
+                method = "copy"
+        self.bytes[method] += size
+        self.files[method] += 1
+        return method
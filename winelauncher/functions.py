@@ -1,20 +1,32 @@
-import configparser
+import json
 import os
-import subprocess
 import sys
-import pathlib
 
-config = configparser.ConfigParser(default_section='common')
+from winelauncher.builds import find_build, find_system_build, refresh_index
+from winelauncher.configsnapshot import CompiledConfig
+
+PUMP_CHUNK_SIZE = 1 << 16
+SYNC_MODES = ("auto", "fsync", "esync", "none")
+SHADER_CACHE_MODES = ("off", "shared", "prefix")
+READAHEAD_MODES = ("off", "on", "record")
+SIZE_SUFFIXES = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
 # Default config
-config['common'] = {
+DEFAULT_CONFIG = {}
+DEFAULT_CONFIG['common'] = {
     "prefix_base": os.path.expanduser("~") + "/wine",
     "wine_dir": "/opt/wine",
     "wine_lib32": "lib32",
     "wine_lib64": "lib",
 }
-config['prefix_default'] = {
+DEFAULT_CONFIG['prefix_default'] = {
     "log_dest": "console",
     "log_level": "info",
+    "log_queue": "1024",
+    "log_overflow": "drop",
+    "debug_dedup": "yes",
+    "debug_rate": "0",
+    "debug_summary": "10",
     "environment": {
         "WINEDEBUG": "fixme-all",
         "NINEDEBUG": "fixme-all",
@@ -23,6 +35,7 @@ config['prefix_default'] = {
         "FREETYPE_PROPERTIES": "truetype:interpreter-version=35",  # Fix for ugly fonts
     }
 }
+config = CompiledConfig(DEFAULT_CONFIG)
 
 
 class Args:
@@ -31,54 +44,118 @@ class Args:
 
 
 def init_config(config_file):
-    """Check if config file exists, otherwise generate a default one"""
-    if pathlib.Path(config_file) and config.read(config_file):
-        print("Using configuration from {}".format(config_file))
-    else:
-        try:
-            with open(config_file, mode="w") as newfile:
-                config.write(newfile)
-            print("Saved default config file {}".format(config_file))
-            sys.exit(0)
-        except OSError as err:
-            print("Cannot open file {}".format(config_file))
-            print("OSError: {0}".format(err))
+    """Generate a default config file"""
+    try:
+        os.makedirs(os.path.dirname(config_file), exist_ok=True)
+        with open(config_file, mode="w") as newfile:
+            config.write(newfile)
+        print("Saved default config file {}".format(config_file))
+        sys.exit(0)
+    except OSError as err:
+        print("Cannot open file {}".format(config_file))
+        print("OSError: {0}".format(err))
+
+
+def reload_config(config_file):
+    """Read the config file again, over the default config"""
+    config.reset()
+    return config.read(config_file)
 
 
 def lookup(config, prefix, option):
-    """Check if the config options is specified for the prefix, then in defaults"""
-    if config.has_option(prefix, option):
-        config_value = config.get(prefix, option)
-    elif config.has_option('prefix_default', option):
-        config_value = config.get('prefix_default', option)
-    else:
-        config_value = None
-    return config_value
+    """Look up an option of the prefix, resolved with the sections it extends and the defaults"""
+    return config.section(prefix).get(option)
+
+
+def lookup_int(config, prefix, option, default):
+    """Look up an integer option, exiting with an error if it is not one"""
+    value = lookup(config, prefix, option)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print("Invalid {} value for {}: {}".format(option, prefix, value))
+        sys.exit(1)
+
 
+def lookup_bool(config, prefix, option, default):
+    """Look up a yes/no option"""
+    value = lookup(config, prefix, option)
+    if value is None:
+        return default
+    if value.lower() not in config.BOOLEAN_STATES:
+        print("Invalid {} value for {}: {} (expected yes or no)".format(option, prefix, value))
+        sys.exit(1)
+    return config.BOOLEAN_STATES[value.lower()]
 
-def list_wine_versions(wine_base):
+
+def lookup_choice(config, prefix, option, choices, default):
+    """Look up an option restricted to a set of values"""
+    value = lookup(config, prefix, option)
+    if value is None:
+        return default
+    if value not in choices:
+        print("Invalid {} value for {}: {} (expected one of {})".format(
+            option, prefix, value, ", ".join(choices)))
+        sys.exit(1)
+    return value
+
+
+def parse_size(value):
+    """Parse a byte count with an optional K, M or G suffix"""
+    value = value.strip().lower()
+    if value[-1:] in SIZE_SUFFIXES:
+        return int(value[:-1]) * SIZE_SUFFIXES[value[-1]]
+    return int(value)
+
+
+def format_size(size):
+    """Format a byte count for humans"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+        size /= 1024.0
+    return "{:.1f} {}".format(size, unit) if unit != "B" else "{} B".format(size)
+
+
+def describe_build(build):
+    """One line summary of an indexed WINE build"""
+    details = [build["version"] or "unknown version"]
+    if build["arches"]:
+        details.append("/".join(build["arches"]) + " bit")
+    if build.get("sync"):
+        details.append("/".join(build["sync"]))
+    if build["size"] is not None:
+        details.append(format_size(build["size"]))
+    return "{} ({})".format(build["name"], ", ".join(details))
+
+
+def list_wine_versions(wine_base, wine_lib32, wine_lib64, as_json=False):
     """Find installed WINE versions"""
-    system_wine = pathlib.Path("/usr/bin/wine")
-    if system_wine.is_file():
-        system_wine_version = str(subprocess.check_output(["/usr/bin/wine", "--version"]), "utf-8")
-    else:
-        system_wine = None
+    index = refresh_index(wine_base, wine_lib32, wine_lib64)
+    system_wine = index["system"]
+    wine_versions_list = [index["builds"][name] for name in sorted(index["builds"])]
 
-    if pathlib.Path(wine_base).exists():
-        wine_versions_list = os.listdir(wine_base)
-    else:
-        wine_versions_list = None
+    if as_json:
+        json.dump({"wine_base": wine_base,
+                   "system": system_wine,
+                   "builds": wine_versions_list}, sys.stdout, indent=2)
+        print()
+        if not system_wine and not wine_versions_list:
+            sys.exit(1)
+        return
 
     if system_wine or wine_versions_list:
         if system_wine:
-            print("System WINE version:\n\t{}".format(system_wine_version))
+            print("System WINE version:\n\t{}".format(system_wine["version"] or "unknown"))
         else:
             print("No system-wine WINE found\n")
 
         if wine_versions_list:
             print("WINE versions available in {}:\n".format(wine_base))
-            for winedir in wine_versions_list:
-                print("\t{}".format(winedir))
+            for build in wine_versions_list:
+                print("\t{}".format(describe_build(build)))
         else:
             print("No additional WINE installs available")
     else:
@@ -86,8 +163,149 @@ def list_wine_versions(wine_base):
         sys.exit(1)
 
 
-def consume_output(pipe, consume):
-    """Get subprocess' output"""
-    with pipe:
-        for line in iter(pipe.readline, b''):
-            consume(line)
+def literal_option(config, config_section, option, kind):
+    """Look up an option holding a Python literal of the given type"""
+    from ast import literal_eval
+    value = lookup(config, config_section, option)
+    if value is None:
+        return None
+    try:
+        value = literal_eval(value)
+    except (SyntaxError, ValueError):
+        value = None
+    if not isinstance(value, kind):
+        print("Invalid {} value for {}: expected a {}".format(option, config_section, kind.__name__))
+        sys.exit(1)
+    return value
+
+
+def check_registry_values(config_section, option, values):
+    """Exit unless values maps value names to strings, integers (REG_DWORD) or None"""
+    for name, value in values.items():
+        if (not isinstance(name, str) or isinstance(value, bool)
+                or not isinstance(value, (str, int, type(None)))):
+            print("Invalid {} value for {}: {!r}: {!r} (expected a string, an integer or "
+                  "None)".format(option, config_section, name, value))
+            sys.exit(1)
+
+
+def registry_settings(config, config_section):
+    """Registry values set by the prefix section, as {file: {key: {name: value}}}"""
+    keys = {}
+    dll_overrides = literal_option(config, config_section, 'dll_overrides', dict)
+    if dll_overrides:
+        check_registry_values(config_section, 'dll_overrides', dll_overrides)
+        keys['HKCU\\Software\\Wine\\DllOverrides'] = dll_overrides
+    windows_version = lookup(config, config_section, 'windows_version')
+    if windows_version:
+        keys['HKCU\\Software\\Wine'] = {'Version': windows_version}
+    for key, values in (literal_option(config, config_section, 'registry', dict) or {}).items():
+        if not isinstance(key, str) or not isinstance(values, dict):
+            print("Invalid registry value for {}: {!r}: {!r} (expected a key name and a dict "
+                  "of values)".format(config_section, key, values))
+            sys.exit(1)
+        check_registry_values(config_section, 'registry', values)
+        keys.setdefault(key, {}).update(values)
+
+    from winelauncher.registry import split_key
+    settings = {}
+    for key, values in keys.items():
+        try:
+            hive, path = split_key(key)
+        except ValueError as err:
+            print("Invalid registry key for {}: {} ({})".format(config_section, key, err))
+            sys.exit(1)
+        settings.setdefault(hive, {}).setdefault(path, {}).update(values)
+    return settings
+
+
+def resolve_launch_plan(args, config, config_section):
+    """Resolve the WINE build, paths and environment needed to launch in a prefix"""
+    wine_version = args.wine_version or lookup(config, config_section, "wine_version")
+    if not wine_version or wine_version == "system":
+        wine_base = '/usr'
+        bin_path = None
+        build = find_system_build()
+    else:
+        wine_base = args.wine_base + '/' + wine_version
+        build = find_build(args.wine_base, wine_version, args.wine_lib32, args.wine_lib64)
+        if not build:
+            print("Unable to find WINE in {}".format(wine_base))
+            sys.exit(1)
+        bin_path = wine_base + '/bin'
+
+    env = {
+        'WINEPREFIX': args.prefix_base + "/" + args.prefix,
+        'WINEVERPATH': wine_base,
+        'WINELOADER': wine_base + '/bin/wine',
+        'WINESERVER': wine_base + '/bin/wineserver',
+    }
+    if args.wine_arch == "32":
+        env['WINEARCH'] = 'win32'
+        env['WINEDLLPATH'] = wine_base + '/' + args.wine_lib32 + '/wine'
+        ld_path = wine_base + '/' + args.wine_lib32
+    else:
+        env['WINEDLLPATH'] = wine_base + '/' + args.wine_lib64 + '/wine'
+        ld_path = wine_base + '/' + args.wine_lib32 + ':' + wine_base + '/' + args.wine_lib64
+
+    from winelauncher.tuning import parse_tuning
+    return {
+        'wine_base': wine_base,
+        'loader': wine_base + '/bin/wine',
+        'bin_path': bin_path,
+        'ld_library_path': ld_path,
+        'env': env,
+        'config_env': lookup(config, config_section, 'environment'),
+        'registry': registry_settings(config, config_section),
+        'tuning': parse_tuning(config, config_section),
+        'sync': build['sync'] if build else [],
+        'sync_mode': lookup_choice(config, config_section, 'sync_mode', SYNC_MODES, 'auto'),
+    }
+
+
+def build_environment(plan, environ):
+    """Build the WINE process environment from a launch plan"""
+    wine_env = dict(environ)
+    if plan['bin_path']:
+        wine_env['PATH'] = plan['bin_path'] + ':' + environ.get('PATH', '')
+    # Add the : delimiter before the eventual existing variable to avoid
+    # including the current path in LD_LIBRARY_PATH
+    cur_ld_path = environ.get('LD_LIBRARY_PATH', None)
+    cur_ld_path = ':' + cur_ld_path if cur_ld_path else ""
+    wine_env['LD_LIBRARY_PATH'] = plan['ld_library_path'] + cur_ld_path
+    wine_env.update(plan['env'])
+    for env_var, value in plan['config_env'].items():
+        wine_env[env_var] = environ.get(env_var, value)
+    return wine_env
+
+
+def pump_output(pipes, consume, chunk_size=PUMP_CHUNK_SIZE):
+    """Read subprocess' pipes from a single thread, passing decoded lines in batches
+
+    pipes maps a stream name to a pipe; consume(name, lines) receives every
+    complete line read from that pipe, without the trailing newline.
+    """
+    import selectors
+    selector = selectors.DefaultSelector()
+    pending = {}
+    for name, pipe in pipes.items():
+        selector.register(pipe.fileno(), selectors.EVENT_READ, name)
+        pending[name] = b''
+
+    while selector.get_map():
+        for key, _ in selector.select():
+            name = key.data
+            chunk = os.read(key.fd, chunk_size)
+            if not chunk:
+                selector.unregister(key.fd)
+                if pending[name]:
+                    consume(name, [pending[name].decode('utf-8', 'replace')])
+                continue
+            data = pending[name] + chunk if pending[name] else chunk
+            cut = data.rfind(b'\n')
+            if cut < 0:
+                pending[name] = data
+                continue
+            pending[name] = data[cut + 1:]
+            consume(name, data[:cut].decode('utf-8', 'replace').split('\n'))
+    selector.close()
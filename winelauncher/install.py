@@ -0,0 +1,244 @@
+import filecmp
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import tempfile
+import time
+
+from winelauncher.builds import find_build, scan_builds
+from winelauncher.functions import describe_build, format_size
+
+# Compression formats by magic number: external decompressors, fastest first, and tarfile mode
+DECOMPRESSORS = [
+    ("zstd", b"\x28\xb5\x2f\xfd", [["zstd", "-dc", "-T0"]], None),
+    ("xz", b"\xfd7zXZ\x00", [["xz", "-dc", "-T0"]], "xz"),
+    ("gzip", b"\x1f\x8b", [["pigz", "-dc"], ["gzip", "-dc"]], "gz"),
+]
+ARCHIVE_EXTENSIONS = (".tar.zst", ".tar.xz", ".tar.gz", ".tzst", ".txz", ".tgz", ".tar")
+LINK_WORKERS = 8
+
+
+class InstallError(Exception):
+    pass
+
+
+def open_archive(path):
+    """Open a tar archive as a stream, decompressed by an external tool when there is one
+
+    Returns the archive, the decompressor process or None, and how it is decompressed.
+    """
+    with open(path, "rb") as archive:
+        magic = archive.read(6)
+    for kind, signature, commands, mode in DECOMPRESSORS:
+        if magic.startswith(signature):
+            break
+    else:
+        kind, commands, mode = "tar", [], ""
+    for command in commands:
+        if shutil.which(command[0]):
+            process = subprocess.Popen(command + [path], stdout=subprocess.PIPE)
+            try:
+                return tarfile.open(fileobj=process.stdout, mode="r|"), process, " ".join(command)
+            except tarfile.TarError as err:
+                process.kill()
+                process.stdout.close()
+                process.wait()
+                raise InstallError("{} is not a tar archive: {}".format(path, err))
+    if mode is None:
+        raise InstallError("{} is needed to unpack {}".format(commands[0][0], path))
+    try:
+        return tarfile.open(path, mode="r|" + mode), None, "python " + kind
+    except (tarfile.TarError, EOFError) as err:
+        raise InstallError("{} is not a tar archive: {}".format(path, err))
+
+
+def check_member(member):
+    """Refuse archive members landing outside the build, and special files"""
+    name = os.path.normpath(member.name)
+    if os.path.isabs(name) or name.split(os.sep)[0] == "..":
+        raise InstallError("Unsafe path in archive: {}".format(member.name))
+    if member.issym():
+        target = os.path.normpath(os.path.join(os.path.dirname(name), member.linkname))
+    elif member.islnk():
+        target = os.path.normpath(member.linkname)
+    elif member.isfile() or member.isdir():
+        return
+    else:
+        raise InstallError("Unsupported file in archive: {}".format(member.name))
+    if os.path.isabs(member.linkname) or target.split(os.sep)[0] == "..":
+        raise InstallError("Unsafe link in archive: {} -> {}".format(member.name, member.linkname))
+
+
+def extract(archive, target):
+    """Extract a stream of archive members, returning their number and total size"""
+    # Python 3.12+ applies its own safety filter on top of check_member
+    options = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    files = 0
+    size = 0
+    for member in archive:
+        check_member(member)
+        archive.extract(member, target, **options)
+        if member.isfile():
+            files += 1
+            size += member.size
+    return files, size
+
+
+def build_root(tree):
+    """Directory of the build in an extracted tree: the tree, or its single top directory"""
+    entries = os.listdir(tree)
+    if len(entries) == 1 and os.path.isdir(os.path.join(tree, entries[0])) \
+            and not os.path.islink(os.path.join(tree, entries[0])):
+        return os.path.join(tree, entries[0])
+    return tree
+
+
+def archive_name(path):
+    name = os.path.basename(path)
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def check_name(name):
+    """Refuse build names that are not a plain directory of wine_base"""
+    if not name or os.sep in name or name.startswith(".") or name == "system":
+        raise InstallError("Invalid build name: {}".format(name))
+
+
+def verify_build(build_dir, wine_lib32, wine_lib64):
+    """Check an extracted build holds a loader, a wineserver and WINE libraries"""
+    for binary in ("bin/wine", "bin/wineserver"):
+        path = os.path.join(build_dir, binary)
+        if not os.path.isfile(path) or not os.access(path, os.X_OK):
+            raise InstallError("No executable {} in the archive".format(binary))
+    lib_dirs = (wine_lib32, wine_lib64)
+    if not any(os.path.isdir(os.path.join(build_dir, lib, "wine")) for lib in lib_dirs):
+        raise InstallError("Neither {0}/wine nor {1}/wine in the archive (found {2}), "
+                           "check --wine-lib32 and --wine-lib64".format(
+                               wine_lib32, wine_lib64, ", ".join(sorted(os.listdir(build_dir)))))
+
+
+def find_duplicate(path, relpath, builds):
+    """File of an installed build identical to path, at the same relative path"""
+    st = os.lstat(path)
+    for build in builds:
+        other = os.path.join(build, relpath)
+        try:
+            other_st = os.lstat(other)
+        except OSError:
+            continue
+        if (stat.S_ISREG(other_st.st_mode) and other_st.st_size == st.st_size
+                and other_st.st_mode == st.st_mode and other_st.st_dev == st.st_dev
+                and filecmp.cmp(path, other, shallow=False)):
+            return other
+    return None
+
+
+def link_duplicates(build_dir, builds):
+    """Replace the files identical to those of installed builds with hardlinks to them
+
+    Returns the number of files and bytes shared.
+    """
+    files = []
+    for root, _, names in os.walk(build_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append((path, os.path.relpath(path, build_dir)))
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=LINK_WORKERS) as pool:
+        duplicates = pool.map(lambda file: find_duplicate(file[0], file[1], builds), files)
+        linked = 0
+        shared = 0
+        for (path, _), other in zip(files, duplicates):
+            if other is None:
+                continue
+            tmp_path = path + ".winelauncher-link"
+            try:
+                os.link(other, tmp_path)
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.lexists(tmp_path):
+                    os.unlink(tmp_path)
+                continue
+            linked += 1
+            shared += os.lstat(path).st_size
+    return linked, shared
+
+
+def install_build(log, archive_path, wine_base, name, wine_lib32, wine_lib64, replace=False):
+    """Install a WINE build from a tar archive as wine_base/name, returning its index entry
+
+    The archive is unpacked in a hidden directory of wine_base, which is
+    renamed into place once verified: the build never shows half installed.
+    """
+    if name:
+        check_name(name)
+    target = os.path.join(wine_base, name or "")
+    if name and os.path.lexists(target) and not replace:
+        raise InstallError("{} is already installed, use --force to replace it".format(target))
+
+    os.makedirs(wine_base, exist_ok=True)
+    tree = tempfile.mkdtemp(prefix=".install-", dir=wine_base)
+    try:
+        start = time.monotonic()
+        archive, process, method = open_archive(archive_path)
+        try:
+            with archive:
+                files, size = extract(archive, tree)
+        except (tarfile.TarError, EOFError) as err:
+            raise InstallError("Cannot unpack {}: {}".format(archive_path, err))
+        finally:
+            if process:
+                process.stdout.close()
+                process.wait()
+        if process and process.returncode:
+            raise InstallError("{} failed with status {}".format(method, process.returncode))
+        elapsed = time.monotonic() - start
+        log.info("Unpacked {} files ({}) with {} in {:.1f} s ({}/s)".format(
+            files, format_size(size), method, elapsed, format_size(size / elapsed if elapsed else 0)))
+
+        build_dir = build_root(tree)
+        if not name:
+            name = os.path.basename(build_dir) if build_dir != tree else archive_name(archive_path)
+            check_name(name)
+            target = os.path.join(wine_base, name)
+            if os.path.lexists(target) and not replace:
+                raise InstallError("{} is already installed, use --force to replace it".format(target))
+        verify_build(build_dir, wine_lib32, wine_lib64)
+        os.chmod(build_dir, 0o755)
+
+        builds = [os.path.join(wine_base, build) for build in scan_builds(wine_base)]
+        linked, shared = link_duplicates(build_dir, builds)
+        if linked:
+            log.info("Hardlinked {} files ({}) identical in installed builds".format(
+                linked, format_size(shared)))
+
+        old = None
+        if os.path.lexists(target):
+            old = tempfile.mkdtemp(prefix=".remove-", dir=wine_base)
+            os.rename(target, os.path.join(old, name))
+        os.rename(build_dir, target)
+    finally:
+        shutil.rmtree(tree, ignore_errors=True)
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+    # The loader may be a hardlink to the one of the replaced build, the index can't tell them apart
+    return find_build(wine_base, name, wine_lib32, wine_lib64, reprobe=True)
+
+
+def run_install(args, log):
+    """Install the WINE build archive given with --install and print it"""
+    try:
+        build = install_build(log, args.install, args.wine_base, args.wine_version,
+                              args.wine_lib32, args.wine_lib64, args.force)
+    except (InstallError, OSError) as err:
+        print("Cannot install {}: {}".format(args.install, err))
+        return 1
+    print("Installed {}".format(describe_build(build)))
+    return 0
@@ -0,0 +1,178 @@
+import itertools
+import json
+import os
+import sys
+import time
+
+from winelauncher.builds import SYSTEM_PREFIX
+from winelauncher.builds import index_path as builds_index_path
+from winelauncher.cache import cache_dir, last_launch, read_json, write_json
+from winelauncher.functions import config, format_size
+
+INVENTORY_WORKERS = 16
+# system.reg lines searched for the #arch header
+ARCH_HEADER_LINES = 16
+
+
+def index_path():
+    return os.path.join(cache_dir(), "inventory.json")
+
+
+def read_arch(prefix):
+    """WINEARCH of a prefix, from the system.reg header written by WINE"""
+    try:
+        with open(os.path.join(prefix, "system.reg"), encoding="utf-8", errors="replace") as reg:
+            for line in itertools.islice(reg, ARCH_HEADER_LINES):
+                if line.startswith("#arch="):
+                    return line[6:].strip()
+    except OSError:
+        return None
+    # WINE releases older than the header only knew 64 bit prefixes by their syswow64
+    return "win64" if os.path.isdir(os.path.join(prefix, "drive_c/windows/syswow64")) else "win32"
+
+
+def file_usage(path):
+    """Allocated size of a file, 0 when it is gone"""
+    try:
+        return os.lstat(path).st_blocks * 512
+    except OSError:
+        return 0
+
+
+def scan_dir(path):
+    """Allocated size of the files of a directory, their names, and its subdirectories"""
+    size = 0
+    files = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_blocks * 512
+                    files.append(entry.name)
+            except OSError:
+                continue
+    return size, files, subdirs
+
+
+def tree_usage(root, cached):
+    """Disk usage of a tree, listing again only the directories whose mtime changed
+
+    cached maps directory paths relative to root to [mtime_ns, files, subdirs];
+    returns the usage, the updated map and the number of directories listed.
+    The files of unchanged directories are still measured, as they may have
+    grown in place.
+    """
+    total = 0
+    dirs = {}
+    listed = 0
+    pending = ["."]
+    while pending:
+        relpath = pending.pop()
+        path = os.path.normpath(os.path.join(root, relpath))
+        try:
+            mtime_ns = os.lstat(path).st_mtime_ns
+            entry = cached.get(relpath)
+            # Entries of older releases hold the directory size in place of the file names
+            if entry is None or entry[0] != mtime_ns or not isinstance(entry[1], list):
+                size, files, subdirs = scan_dir(path)
+                entry = [mtime_ns, files, subdirs]
+                listed += 1
+            else:
+                size = sum(file_usage(os.path.join(path, name)) for name in entry[1])
+        except OSError:
+            continue
+        dirs[relpath] = entry
+        total += size
+        pending.extend(os.path.join(relpath, name) for name in entry[2])
+    return total, dirs, listed
+
+
+def build_versions():
+    """Map of WINE build directories to their version, from the build index"""
+    index = read_json(builds_index_path(), {})
+    versions = {}
+    for builds in index.get("bases", {}).values():
+        for build in builds.values():
+            versions[build["path"]] = build["version"]
+    if index.get("system"):
+        versions[SYSTEM_PREFIX] = index["system"]["version"]
+    return versions
+
+
+def inspect_prefix(path, cached):
+    """Collect the inventory entry of a prefix"""
+    size, dirs, listed = tree_usage(path, cached.get("dirs", {}))
+    launch = last_launch(path) or {}
+    name = os.path.basename(path)
+    return {
+        "name": name,
+        "path": path,
+        "section": name if config.has_section(name) else "prefix_default",
+        "arch": read_arch(path),
+        "size": size,
+        "wine_base": launch.get("wine_base"),
+        "last_launch": launch.get("time"),
+        "dirs": dirs,
+        "listed": listed,
+    }
+
+
+def scan_prefixes(prefix_base):
+    """Inventory every prefix under prefix_base, returning the entries and the directories listed"""
+    try:
+        paths = sorted(entry.path for entry in os.scandir(prefix_base)
+                       if entry.is_dir() and not entry.name.startswith(".")
+                       and os.path.isfile(os.path.join(entry.path, "system.reg")))
+    except OSError:
+        paths = []
+    index = read_json(index_path(), {})
+    known = index.get("prefixes", {})
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=INVENTORY_WORKERS) as pool:
+        entries = list(pool.map(lambda path: inspect_prefix(path, known.get(path, {})), paths))
+
+    prefixes = {path: value for path, value in known.items()
+                if not path.startswith(os.path.join(prefix_base, ""))}
+    for entry in entries:
+        prefixes[entry["path"]] = {"dirs": entry.pop("dirs")}
+    write_json(index_path(), {"prefixes": prefixes})
+    return entries
+
+
+def run_inventory(args, log):
+    """Print the inventory of the prefixes under prefix_base"""
+    start = time.monotonic()
+    entries = scan_prefixes(args.prefix_base)
+    elapsed = time.monotonic() - start
+    versions = build_versions()
+    listed = 0
+    for entry in entries:
+        entry["wine_version"] = versions.get(entry["wine_base"])
+        listed += entry.pop("listed")
+    log.debug("Inventory of {} listed {} directories in {:.2f} s".format(
+        args.prefix_base, listed, elapsed))
+
+    if args.json:
+        json.dump({"prefix_base": args.prefix_base, "prefixes": entries}, sys.stdout, indent=2)
+        print()
+        return 0
+
+    print("{:<24} {:<6} {:>10}  {:<24} {:<16} {}".format(
+        "prefix", "arch", "size", "last WINE", "last launch", "section"))
+    for entry in entries:
+        print("{:<24} {:<6} {:>10}  {:<24} {:<16} {}".format(
+            entry["name"],
+            entry["arch"] or "-",
+            format_size(entry["size"]),
+            entry["wine_version"] or (os.path.basename(entry["wine_base"])
+                                      if entry["wine_base"] else "-"),
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_launch"]))
+            if entry["last_launch"] else "never",
+            entry["section"]))
+    print("{} prefixes, {} in {:.2f} s ({} directories listed)".format(
+        len(entries), format_size(sum(entry["size"] for entry in entries)), elapsed, listed))
+    return 0
@@ -1,170 +1,584 @@
 import argparse
-import configparser
 import os
-import pathlib
-import subprocess
 import sys
+import time
 
-from textwrap import dedent
-from threading import Thread
-from ast import literal_eval
-from xdg.BaseDirectory import xdg_config_home
+from winelauncher.cache import load_plan, plan_key, record_launch, save_plan
 from winelauncher.functions import *
+from winelauncher.winesync import select_sync
 from winelauncher.winelog import *
 
-log = None
-wine_env = wine_exec = config_env = {}
-
-args = Args()
-configfile = argparse.ArgumentParser(
-    description=__doc__,
-    add_help=False)
-configfile.add_argument(
-    "-c", "--config",
-    help="alternate config file",
-    default=xdg_config_home + "/winelauncher.conf",
-    dest='config_file',
-    metavar="FILE")
-configfile.add_argument("--prefix",
-                        help="WINEPREFIX name",
-                        default="")
-args, remaining_argv = configfile.parse_known_args(namespace=args)
-
-if config.read(args.config_file):
-    print("Using config from: {}".format(args.config_file))
-else:
-    print("No config file found, generating a default one at: {}".format(args.config_file))
-    init_config(args.config_file)
-
-if config.has_section(args.prefix):
-    config_section = args.prefix
-else:
-    config_section = 'prefix_default'
-
-parser = argparse.ArgumentParser(
-    description="winelauncher: command line WINE wrapper",
-    parents=[configfile],
-    epilog=dedent("""
-        winelauncher will forward LD_PRELOAD, WINEDEBUG and NINEDEBUG environment variables to WINE
-        """))
-
-# WINE and prefixes locations
-general = parser.add_argument_group("WINE options")
-general.add_argument("--prefix-base",
-                     default=config.get('common', 'prefix_base'),
-                     help="prefixes base directory")
-general.add_argument("--wine-base",
-                     default=config.get('common', 'wine_dir'),
-                     help="WINE installation base directory")
-general.add_argument("--wine-lib32",
-                     default=config.get('common', 'wine_lib32'),
-                     help="lib directory for 32 bit libraries")
-general.add_argument("--wine-lib64",
-                     default=config.get('common', 'wine_lib64'),
-                     help="lib directory for 64 bit libraries")
-
-# Logger options
-logger = parser.add_argument_group("Logger options")
-logger.add_argument("--log-level",
-                    default=lookup(config, config_section, 'log_level'),
-                    help="set log level")
-logger.add_argument("--log-output",
-                    default=lookup(config, config_section, 'log_dest'),
-                    help="log messages detination")
-
-# General WINE options
-parser.add_argument("--wine-version",
-                    default=None,
-                    help="WINE version to use")
-parser.add_argument("--wine-arch",
-                    help="WINEARCH to use",
-                    choices=["32", "64"],
-                    default=lookup(config, config_section, 'wine_arch'))
-parser.add_argument("--list",
-                    help="list WINE versions available",
-                    action="store_true")
-parser.add_argument("winecommand", nargs='*',
-                    help="command to execute with WINE")
-parser.parse_args(remaining_argv, namespace=args)
-
-
-def main():
+LAUNCH_MODES = ("supervise", "exec")
+# wineserver persistence of --warm when the prefix section sets none, in seconds
+DEFAULT_PERSIST = 300
+EPILOG = """
+winelauncher will forward LD_PRELOAD, WINEDEBUG and NINEDEBUG environment variables to WINE
+"""
+
+
+def parse_args(argv=None, load=True):
+    """Parse the command line, using the config file for the defaults
+
+    With load false the config file is expected to be loaded already.
+    """
+    args = Args()
+    configfile = argparse.ArgumentParser(
+        description=__doc__,
+        add_help=False)
+    configfile.add_argument(
+        "-c", "--config",
+        help="alternate config file",
+        default=None,
+        dest='config_file',
+        metavar="FILE")
+    configfile.add_argument("--prefix",
+                            help="WINEPREFIX name",
+                            default="")
+    args, remaining_argv = configfile.parse_known_args(argv, namespace=args)
+    if args.config_file is None:
+        from xdg.BaseDirectory import xdg_config_home
+        args.config_file = xdg_config_home + "/winelauncher.conf"
+
+    if load:
+        if config.read(args.config_file):
+            print("Using config from: {}".format(args.config_file), file=sys.stderr)
+        else:
+            print("No config file found, generating a default one at: {}".format(args.config_file))
+            init_config(args.config_file)
+
+    if config.has_section(args.prefix):
+        config_section = args.prefix
+    else:
+        config_section = 'prefix_default'
+
+    parser = argparse.ArgumentParser(
+        description="winelauncher: command line WINE wrapper",
+        parents=[configfile],
+        epilog=EPILOG)
+
+    # WINE and prefixes locations
+    general = parser.add_argument_group("WINE options")
+    general.add_argument("--prefix-base",
+                         default=config.get('common', 'prefix_base'),
+                         help="prefixes base directory")
+    general.add_argument("--wine-base",
+                         default=config.get('common', 'wine_dir'),
+                         help="WINE installation base directory")
+    general.add_argument("--wine-lib32",
+                         default=config.get('common', 'wine_lib32'),
+                         help="lib directory for 32 bit libraries")
+    general.add_argument("--wine-lib64",
+                         default=config.get('common', 'wine_lib64'),
+                         help="lib directory for 64 bit libraries")
+
+    # Logger options
+    logger = parser.add_argument_group("Logger options")
+    logger.add_argument("--log-level",
+                        default=lookup(config, config_section, 'log_level'),
+                        help="set log level")
+    logger.add_argument("--log-output",
+                        default=lookup(config, config_section, 'log_dest'),
+                        help="log messages detination")
+    logger.add_argument("--log-passthrough",
+                        action="store_true",
+                        default=lookup_bool(config, config_section, 'log_passthrough', False),
+                        help="write WINE output unprocessed to the log file")
+
+    # Batch options
+    batch = parser.add_argument_group("Batch options")
+    batch.add_argument("--batch",
+                       metavar="FILE",
+                       help="run the jobs listed in FILE, one winelauncher command line per line")
+    batch.add_argument("--batch-glob",
+                       metavar="GLOB",
+                       help="run winecommand in every prefix matching GLOB")
+    batch.add_argument("--jobs",
+                       type=int,
+                       default=os.cpu_count() or 1,
+                       help="number of jobs to run at once")
+    batch.add_argument("--jobs-per-build",
+                       type=int,
+                       default=0,
+                       help="number of jobs to run at once with the same WINE build")
+    batch.add_argument("--batch-logs",
+                       metavar="DIR",
+                       help="directory for the job logs and summary")
+
+    # General WINE options
+    parser.add_argument("--wine-version",
+                        default=None,
+                        help="WINE version to use")
+    parser.add_argument("--wine-arch",
+                        help="WINEARCH to use",
+                        choices=["32", "64"],
+                        default=lookup(config, config_section, 'wine_arch'))
+    parser.add_argument("--launch-mode",
+                        help="supervise WINE, or exec it in place of the launcher",
+                        choices=LAUNCH_MODES,
+                        default=lookup_choice(config, config_section, 'launch_mode',
+                                              LAUNCH_MODES, 'supervise'))
+    parser.add_argument("--list",
+                        help="list WINE versions available",
+                        action="store_true")
+    parser.add_argument("--json",
+                        help="print --list and --inventory output as JSON",
+                        action="store_true")
+    parser.add_argument("--inventory",
+                        help="list the prefixes with their size, arch and last launch",
+                        action="store_true")
+    parser.add_argument("--warm",
+                        help="start a persistent wineserver for the prefix",
+                        action="store_true")
+    parser.add_argument("--create",
+                        help="create the prefix by cloning the template of its WINE build",
+                        action="store_true")
+    parser.add_argument("--dedup",
+                        help="share the identical DLLs and fonts of all prefixes",
+                        action="store_true")
+    parser.add_argument("--dedup-hardlinks",
+                        help="without reflinks, hardlink the wine builtin DLLs and make them "
+                             "read-only",
+                        action="store_true")
+    parser.add_argument("--dry-run",
+                        help="only report the space --dedup would reclaim",
+                        action="store_true")
+    parser.add_argument("--install",
+                        metavar="ARCHIVE",
+                        help="install a WINE build from a tar archive into --wine-base, "
+                             "named after --wine-version or the archive")
+    parser.add_argument("--shutdown",
+                        help="stop the wineserver of the prefix",
+                        action="store_true")
+    parser.add_argument("--daemon",
+                        help="serve launches from winelauncher-client over a Unix socket",
+                        action="store_true")
+    parser.add_argument("--force",
+                        help="run winetricks verbs already applied to the prefix, "
+                             "replace a build with --install",
+                        action="store_true")
+    parser.add_argument("--no-cache",
+                        help="resolve the launch environment without the launch plan cache",
+                        action="store_true")
+    parser.add_argument("winecommand", nargs='*',
+                        help="command to execute with WINE")
+    parser.parse_args(remaining_argv, namespace=args)
+    return args, config_section
+
+
+def launch_environment(args, config_section, log, environ, plans=None, config=config):
+    """Resolve the launch plan of the prefix and build its WINE environment
+
+    plans optionally memoizes the resolved launch plans in memory.
+    """
+    # Resolve the WINE build and environment, or reuse the cached resolution
+    cache_key = plan_key(args.config_file, args)
+    if plans is not None and cache_key in plans:
+        plan = plans[cache_key]
+    else:
+        plan = None if args.no_cache else load_plan(cache_key)
+    if plan:
+        log.debug("Using cached launch plan {}".format(cache_key))
+    else:
+        plan = resolve_launch_plan(args, config, config_section)
+        save_plan(cache_key, plan)
+    if plans is not None:
+        plans[cache_key] = plan
+    wine_env = build_environment(plan, environ)
+    log.info('Enviroment: {}'.format(wine_env))
+    return plan, wine_env
+
+
+def wineserver_persist(config_section, config=config):
+    """Persistence of the prefix wineserver: seconds, "infinite" or None to leave it to WINE"""
+    persist = lookup(config, config_section, 'wineserver_persist')
+    if persist is None or persist == "infinite":
+        return persist
+    if not persist.isdigit():
+        print("Invalid wineserver_persist value for {}: {} (expected seconds or infinite)".format(
+            config_section, persist))
+        sys.exit(1)
+    return int(persist) or None
+
+
+def shader_cache_settings(config_section, config=config):
+    """Shader cache mode, directory and size limit of the prefix, None when not managed"""
+    mode = lookup_choice(config, config_section, 'shader_cache', SHADER_CACHE_MODES, 'off')
+    if mode == 'off':
+        return None
+    base = config.get('common', 'shader_cache_dir', fallback=None)
+    if not base:
+        from winelauncher.cache import cache_dir
+        base = os.path.join(cache_dir(), "shaders")
+    limit = lookup(config, config_section, 'shader_cache_size') or "0"
+    try:
+        return mode, base, parse_size(limit)
+    except ValueError:
+        print("Invalid shader_cache_size value for {}: {}".format(config_section, limit))
+        sys.exit(1)
+
+
+def winetricks_cache(config=config):
+    """Download cache shared by the winetricks runs of every prefix"""
+    path = config.get('common', 'winetricks_cache', fallback=None)
+    if not path:
+        from winelauncher.cache import cache_dir
+        path = os.path.join(cache_dir(), "winetricks")
+    return path
+
+
+def launch_wrapper(log, plan):
+    """Command prefix applying the prefix scheduling and resource settings to WINE, or []"""
+    if not plan.get('tuning'):
+        return []
+    from winelauncher.tuning import tuning_command
+    return tuning_command(log, plan['tuning'])
+
+
+def resolve_launch(args, config_section, log, environ, plans=None, config=config):
+    """Resolve the command line, environment and settings of a launch, leaving the prefix alone
+
+    Returns the launch, a dict handed to start_launch.
+    """
+    plan, wine_env = launch_environment(args, config_section, log, environ, plans, config)
+    select_sync(log, plan, wine_env)
+    shader_cache = shader_cache_settings(config_section, config)
+    if shader_cache:
+        from winelauncher.shadercache import setup_shader_cache
+        setup_shader_cache(log, wine_env, shader_cache[1], shader_cache[0])
+    wine_exec = list(args.winecommand)
+    if wine_exec[0] != 'winetricks':
+        wine_exec.insert(0, plan['loader'])
+    return {
+        'plan': plan,
+        'wine_exec': wine_exec,
+        'wine_env': wine_env,
+        'wrapper': launch_wrapper(log, plan),
+        'persist': wineserver_persist(config_section, config),
+        'winetricks_cache': winetricks_cache(config) if wine_exec[0] == 'winetricks' else None,
+        'force': args.force,
+    }
+
+
+def start_launch(log, launch):
+    """Get the prefix ready for a resolved launch, returning its command, environment and wrapper
+
+    Writes the registry settings, starts the persistent wineserver, records
+    the launch and drops the winetricks verbs already applied. The wrapper is
+    a command prefix to start WINE with, empty without tuning. The command is
+    None when there is nothing left to run: every winetricks verb requested
+    was already applied to the prefix.
+    """
+    plan = launch['plan']
+    wine_exec = launch['wine_exec']
+    wine_env = dict(launch['wine_env'])
+    wrapper = launch['wrapper']
+    if plan.get('registry'):
+        # Before the wineserver starts, it would overwrite the registry files on exit
+        from winelauncher.registry import apply_settings
+        apply_settings(log, wine_env['WINEPREFIX'], plan['registry'])
+    if launch['persist']:
+        from winelauncher.wineserver import ensure_server
+        ensure_server(log, wine_env, launch['persist'], wrapper)
+
+    record_launch(wine_env['WINEPREFIX'], plan['wine_base'])
+
+    if wine_exec[0] == 'winetricks':
+        from winelauncher.winetricks import setup_winetricks
+        wine_exec = setup_winetricks(log, wine_exec, wine_env, launch['winetricks_cache'],
+                                     launch['force'])
+        if wine_exec:
+            log.info('Running winetricks: {}'.format(wine_exec))
+    else:
+        log.info('WINE command: {}'.format(wine_exec))
+    return wine_exec, wine_env, wrapper
+
+
+def prepare_launch(args, config_section, log, environ, plans=None, config=config):
+    """Resolve a launch and get the prefix ready for it, see start_launch"""
+    return start_launch(log, resolve_launch(args, config_section, log, environ, plans, config))
+
+
+def flush_log(log):
+    """Write out the pending log records before WINE takes over the output"""
+    for handler in log.handlers:
+        handler.flush()
+
+
+def open_log_output(log_output):
+    """Open the log file for WINE to append its output to"""
+    try:
+        return os.open(log_output, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    except OSError as err:
+        print("Cannot open file {}".format(log_output))
+        print("OSError: {0}".format(err))
+        sys.exit(1)
+
+
+def exec_wine(log, wine_exec, wine_env, log_output=None, wrapper=()):
+    """Replace the launcher with WINE, optionally redirecting its output to log_output"""
+    log.info('Executing WINE in place of the launcher')
+    flush_log(log)
+    if wrapper:
+        # No fork here, the tuning is applied in place rather than through the wrapper
+        import json
+        from winelauncher.tunedexec import apply_tuning
+        try:
+            apply_tuning(json.loads(wrapper[-1]))
+        except OSError as err:
+            print("Cannot apply the prefix tuning: {}".format(err), file=sys.stderr)
+            sys.exit(1)
+    if log_output:
+        output = open_log_output(log_output)
+        os.dup2(output, sys.stdout.fileno())
+        os.dup2(output, sys.stderr.fileno())
+        os.close(output)
+    try:
+        os.execvpe(wine_exec[0], wine_exec, wine_env)
+    except OSError as err:
+        print("Cannot execute {}".format(wine_exec[0]), file=sys.stderr)
+        print("OSError: {0}".format(err), file=sys.stderr)
+        sys.exit(1)
+
+
+def supervised_features(config_section, wine_exec, config=config):
+    """Settings of a launch only the supervising launcher applies, the daemon can't serve them
+
+    The debug output filter is not one of them, the daemon filters the output itself.
+    """
+    features = []
+    if lookup_bool(config, config_section, 'metrics', False):
+        features.append('metrics')
+    if lookup_choice(config, config_section, 'readahead', READAHEAD_MODES, 'off') != 'off':
+        features.append('readahead')
+    if lookup_choice(config, config_section, 'shader_cache', SHADER_CACHE_MODES, 'off') != 'off':
+        features.append('shader_cache')
+    if wine_exec and wine_exec[0] == 'winetricks':
+        features.append('winetricks')
+    return features
+
+
+def debug_output_filter(config_section, structured=False, config=config):
+    """WINE debug output filter of the prefix, None when its output is passed as is"""
+    debug_dedup = lookup_bool(config, config_section, 'debug_dedup', True)
+    debug_rate = lookup_int(config, config_section, 'debug_rate', 0)
+    if not (debug_dedup or debug_rate or structured):
+        return None
+    from winelauncher.winedebug import WineDebugFilter
+    return WineDebugFilter(
+        dedup=debug_dedup,
+        rate=debug_rate,
+        burst=lookup_int(config, config_section, 'debug_burst', debug_rate),
+        summary_interval=lookup_int(config, config_section, 'debug_summary', 10),
+        structured=structured)
+
+
+def output_consumer(log, config_section, log_output):
+    """Build the pump consumer of WINE output, and the callback flushing it at exit"""
+    structured = log_output == 'journal'
+    debug_filter = debug_output_filter(config_section, structured)
+    if debug_filter is None:
+        return (lambda stream, lines: log_lines(log, stream, lines)), lambda: None
+
+    def consume(stream, lines):
+        lines, fields = debug_filter.process(lines)
+        log_lines(log, stream, lines, fields=fields if structured else None)
+
+    def finish():
+        lines, fields = debug_filter.flush()
+        log_lines(log, 'stderr', lines, fields=fields if structured else None)
+
+    return consume, finish
+
+
+def record_metrics(log, config_section, record, launch):
+    """Append the metrics of a launch to the metrics file, and log them"""
+    from winelauncher.metrics import journal_fields, write_record
+    record = dict(launch, **record)
+    path = lookup(config, config_section, 'metrics_file')
+    if not path:
+        from winelauncher.cache import cache_dir
+        path = os.path.join(cache_dir(), "metrics.jsonl")
+    write_record(path, record)
+    extra = None
+    if lookup_bool(config, config_section, 'metrics_journal', False):
+        extra = journal_fields(record)
+    log.info('Launch metrics: overhead {} ms, first output {} ms, runtime {} s, exit status {}, '
+             'peak RSS {}, CPU {} s, {} lines'.format(
+                 record['overhead_ms'], record['first_output_ms'], record['runtime_s'],
+                 record['exit_status'], format_size(record['peak_rss']), record['cpu_s'],
+                 record['lines']), extra=extra)
+
+
+def main(argv=None):
+    start = time.monotonic()
+    args, config_section = parse_args(argv)
     syslog_tag = args.prefix if args.prefix else 'wine'
-    log = logger_init(syslog_tag, args.log_output, args.log_level)
+    log = logger_init(syslog_tag, args.log_output, args.log_level,
+                      lookup_int(config, config_section, 'log_queue', 1024),
+                      lookup_choice(config, config_section, 'log_overflow', OVERFLOW_POLICIES, 'drop'))
     log.debug("Logger initialized.")
     log.info("Args: {}".format(args))
-    # Load config from file or generate a default one
+
+    if args.daemon:
+        from winelauncher.daemon import serve
+        serve(args, log)
+        sys.exit(0)
+
+    if args.batch or args.batch_glob:
+        from winelauncher.batch import run_batch
+        sys.exit(run_batch(args, log))
+
+    if args.inventory:
+        from winelauncher.inventory import run_inventory
+        sys.exit(run_inventory(args, log))
+
+    if args.dedup:
+        from winelauncher.dedup import run_dedup
+        sys.exit(run_dedup(args, log))
+
+    if args.install:
+        from winelauncher.install import run_install
+        sys.exit(run_install(args, log))
+
+    if args.create:
+        from winelauncher.prefixes import create_prefix
+        plan, wine_env = launch_environment(args, config_section, log, os.environ)
+        template_dir = config.get('common', 'template_dir',
+                                  fallback=os.path.join(args.prefix_base, ".templates"))
+        sys.exit(create_prefix(log, wine_env, template_dir,
+                               lookup_bool(config, config_section, 'template_hardlinks', False)))
+
+    if args.warm or args.shutdown:
+        from winelauncher.wineserver import ensure_server, stop_server
+        plan, wine_env = launch_environment(args, config_section, log, os.environ)
+        if args.warm:
+            ensure_server(log, wine_env, wineserver_persist(config_section) or DEFAULT_PERSIST,
+                          launch_wrapper(log, plan))
+        elif not stop_server(wine_env):
+            log.warning("No wineserver stopped for {}".format(wine_env['WINEPREFIX']))
+        sys.exit(0)
 
     if not args.winecommand or args.list:
-        list_wine_versions(args.wine_base)
+        list_wine_versions(args.wine_base, args.wine_lib32, args.wine_lib64, args.json)
         sys.exit(0)
 
-    # Set the executables to use and populate the environment
-    # check if LD_LIBRARY_PATH is set
-    cur_ld_path = os.environ.get('LD_LIBRARY_PATH', None)
-    # Add the : delimiter before the eventual existing variable to avoid
-    # including the current path in LD_LIBRARY_PATH
-    cur_ld_path = ':' + cur_ld_path if cur_ld_path else ""
-    wine_env = os.environ
-    if lookup(config, args.prefix, "wine_version") and not args.wine_version:
-        wine_base = args.wine_base + '/' + lookup(config, args.prefix, "wine_version")
-        try:
-            subprocess.check_output([wine_base + "/bin/wine", "--version"])
-        except subprocess.CalledProcessError:
-            print("Unable to find WINE in {}".format(wine_base))
-            sys.exit(1)
-        wine_env['PATH'] = wine_base + '/bin:' + os.environ.get('PATH')
-    elif args.wine_version == "system" or not args.wine_version:
-        wine_base = '/usr'
-    else:
-        wine_base = args.wine_base + '/' + args.wine_version
-        try:
-            subprocess.check_output([wine_base + "/bin/wine", "--version"])
-        except subprocess.CalledProcessError:
-            print("Unable to find WINE in {}".format(wine_base))
-            sys.exit(1)
-        wine_env['PATH'] = wine_base + '/bin:' + os.environ.get('PATH')
+    wine_exec, wine_env, wrapper = prepare_launch(args, config_section, log, os.environ)
+    if wine_exec is None:
+        log.info('Nothing left to run')
+        sys.exit(0)
 
-    wine_env['WINEPREFIX'] = config.get('common', 'prefix_base') + "/" + args.prefix
-    wine_env['WINEVERPATH'] = wine_base
-    wine_env['WINELOADER'] = wine_base + '/bin/wine'
-    wine_env['WINESERVER'] = wine_base + '/bin/wineserver'
+    shader_cache = shader_cache_settings(config_section)
+    if shader_cache:
+        from winelauncher.shadercache import maintain_shader_cache
 
-    if args.wine_arch == "32":
-        wine_env['WINEARCH'] = 'win32'
-        wine_env['WINEDLLPATH'] = wine_base + '/' + args.wine_lib32 + '/wine'
-        wine_env['LD_LIBRARY_PATH'] = wine_base + '/' + args.wine_lib32 + cur_ld_path
-    else:
-        #wine_env['WINEARCH'] = 'win64'
-        wine_env['WINEDLLPATH'] = wine_base + '/' + args.wine_lib64 + '/wine'
-        wine_env['LD_LIBRARY_PATH'] = wine_base + '/' + args.wine_lib32 + ':' + wine_base + '/' + args.wine_lib64 + cur_ld_path
+    readahead = lookup_choice(config, config_section, 'readahead', READAHEAD_MODES, 'off')
+    profile = None
+    if readahead != 'off':
+        from winelauncher.readahead import (load_profile, profile_path, save_profile,
+                                            start_readahead)
+        profile_file = profile_path(wine_env['WINEPREFIX'], wine_exec)
+        profile = load_profile(profile_file)
+    if readahead == 'on' and profile:
+        log.info('Reading ahead {} files ({})'.format(len(profile['files']),
+                                                    format_size(profile['size'])))
+        start_readahead(profile['files'])
 
-    config_env = literal_eval(lookup(config, config_section, 'environment'))
-    if config_env:
-        for env_var, value in config_env.items():
-            wine_env[env_var] = os.environ.get(env_var, value)
+    metrics = None
+    if lookup_bool(config, config_section, 'metrics', False):
+        from winelauncher.metrics import LaunchMetrics
+        metrics = LaunchMetrics(start)
 
-    log.info('Enviroment: {}'.format(wine_env))
-    wine_exec = args.winecommand
-    if wine_exec[0] == 'winetricks':
-        log.info('Running winetricks')
+    passthrough = args.log_passthrough and args.log_output not in ('console', 'journal')
+    if args.launch_mode == 'exec':
+        if readahead == 'record':
+            log.warning('Recording a readahead profile needs a supervised launch')
+        elif args.log_output == 'console' or passthrough:
+            # No launcher is left to look after the shader cache once WINE exits
+            if shader_cache:
+                maintain_shader_cache(log, wine_env, shader_cache[1], shader_cache[0],
+                                      shader_cache[2])
+            if metrics:
+                log.debug('No launch metrics in the exec launch mode')
+            exec_wine(log, wine_exec, wine_env, args.log_output if passthrough else None, wrapper)
+        log.warning('The exec launch mode needs console or passthrough logging, supervising WINE')
+
+    # Only a supervised launch needs the process machinery
+    import subprocess
+
+    if passthrough:
+        # Hand the log file to WINE, its output never goes through the launcher
+        log.info('Passing WINE output through to {}'.format(args.log_output))
+        flush_log(log)
+        output = open_log_output(args.log_output)
     else:
-        wine_exec.insert(0, wine_base + '/bin/wine')
-        log.info('WINE command: {}'.format(wine_exec))
+        output = subprocess.PIPE
 
     # Spawn WINE process
+    spawn_time = time.monotonic()
     wine_p = subprocess.Popen(
-        wine_exec,
-        bufsize=1,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        wrapper + wine_exec,
+        stdout=output,
+        stderr=output,
         env=wine_env)
+    if metrics:
+        metrics.spawned(wine_env['WINEPREFIX'])
+    if readahead == 'record':
+        from winelauncher.readahead import ProfileRecorder
+        recorder = ProfileRecorder(wine_env['WINEPREFIX'])
+        recorder.start()
+    verb_timer = None
+    if wine_exec[0] == 'winetricks':
+        from winelauncher.winetricks import VerbTimer
+        verb_timer = VerbTimer(wine_env['WINEPREFIX'])
+        verb_timer.start()
 
-    consume = lambda line: log.info(line.decode('utf-8', 'replace'))
-    Thread(target=consume_output, args=[wine_p.stdout, consume]).start()
-    Thread(target=consume_output, args=[wine_p.stderr, consume]).start()
+    first_output = None
+    if passthrough:
+        os.close(output)
+    else:
+        consume, finish = output_consumer(log, config_section, args.log_output)
+
+        def timed_consume(stream, lines):
+            nonlocal first_output
+            if first_output is None:
+                first_output = time.monotonic() - spawn_time
+            if metrics:
+                metrics.output(lines)
+            consume(stream, lines)
+
+        with wine_p.stdout, wine_p.stderr:
+            pump_output({'stdout': wine_p.stdout, 'stderr': wine_p.stderr}, timed_consume)
+        finish()
     wine_p.wait()
 
+    if verb_timer:
+        for verb, seconds in verb_timer.stop().items():
+            log.info('Winetricks verb {} applied in {:.1f} s'.format(verb, seconds))
+
+    if metrics:
+        record_metrics(log, config_section, metrics.finish(wine_p.returncode, not passthrough), {
+            "time": time.time(),
+            "prefix": wine_env['WINEPREFIX'],
+            "section": config_section,
+            "command": wine_exec,
+            "wine_base": wine_env['WINEVERPATH'],
+            "log_output": args.log_output,
+            "passthrough": passthrough,
+        })
+
+    if readahead == 'record':
+        files = recorder.stop()
+        save_profile(profile_file, files, first_output)
+        log.info('Recorded readahead profile of {} files in {} samples'.format(
+            len(files), recorder.samples))
+    elif readahead == 'on' and first_output is not None:
+        recorded = profile and profile.get('first_output')
+        log.info('First output after {:.3f} s{}'.format(
+            first_output, ' ({:.3f} s when recorded without readahead)'.format(recorded)
+            if recorded else ''))
+
+    if shader_cache:
+        maintain_shader_cache(log, wine_env, shader_cache[1], shader_cache[0], shader_cache[2])
     sys.exit(0)
 
 
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+
+from winelauncher.procfs import WineProcesses, process_usage, start_time
+
+# Seconds between two samples of the memory and CPU use of the WINE processes
+METRICS_INTERVAL = 0.5
+
+
+class LaunchMetrics:
+    """Measure a supervised launch: overhead, output, runtime and resource use
+
+    Memory and CPU time are sampled from /proc for every process of the
+    prefix, wineserver included; the launcher's reaped children are also
+    accounted exactly through getrusage.
+    """
+
+    def __init__(self, start, interval=METRICS_INTERVAL):
+        self.start = start
+        self.interval = interval
+        self.spawn = None
+        self.first_output = None
+        self.lines = 0
+        self.bytes = 0
+        self.peak_rss = 0
+        self.cpu = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+        self.children = None
+
+    def spawned(self, prefix):
+        """Note the WINE spawn time and start sampling the prefix processes"""
+        import resource
+        self.spawn = time.monotonic()
+        self.children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.thread = threading.Thread(target=self.sample, args=[WineProcesses(prefix)],
+                                       daemon=True)
+        self.thread.start()
+
+    def sample(self, processes):
+        while True:
+            rss = 0
+            for pid in processes.pids():
+                usage = process_usage(pid)
+                if usage:
+                    rss += usage[0]
+                    self.cpu[(pid, start_time(pid))] = usage[1]
+            self.peak_rss = max(self.peak_rss, rss)
+            self.samples += 1
+            if self.stopped.wait(self.interval):
+                return
+
+    def output(self, lines):
+        if self.first_output is None:
+            self.first_output = time.monotonic()
+        self.lines += len(lines)
+        # Lines are decoded, count their UTF-8 size and not their characters
+        self.bytes += sum(len(line.encode("utf-8")) + 1 for line in lines)
+
+    def finish(self, status, counted=True):
+        """Stop sampling, returning the launch record
+
+        counted is false when the output went to the log file without
+        passing through the launcher.
+        """
+        import resource
+        end = time.monotonic()
+        self.stopped.set()
+        self.thread.join()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "overhead_ms": round((self.spawn - self.start) * 1000, 1),
+            "first_output_ms": round((self.first_output - self.spawn) * 1000, 1)
+            if self.first_output else None,
+            "runtime_s": round(end - self.spawn, 3),
+            "exit_status": status,
+            "peak_rss": self.peak_rss,
+            "cpu_s": round(sum(self.cpu.values()), 2),
+            "children_cpu_s": round(children.ru_utime + children.ru_stime
+                                    - self.children.ru_utime - self.children.ru_stime, 2),
+            "children_max_rss": children.ru_maxrss * 1024,
+            "lines": self.lines if counted else None,
+            "bytes": self.bytes if counted else None,
+            "samples": self.samples,
+        }
+
+
+def write_record(path, record):
+    """Append a record to a JSONL file in a single write, safe for concurrent launches"""
+    data = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+    except OSError as err:
+        print("Cannot write metrics file {}".format(path))
+        print("OSError: {0}".format(err))
+
+
+def journal_fields(record):
+    """Journal fields of a launch record"""
+    return {"WINELAUNCHER_" + key.upper(): value for key, value in record.items()
+            if value is not None and not isinstance(value, (list, dict))}
@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+
+from winelauncher.fileops import Cloner
+
+TEMPLATE_INFO = ".winelauncher-template.json"
+# Windows system directories whose binaries wine installs and never modifies in place
+SHARED_DIRS = ("drive_c/windows/system32", "drive_c/windows/syswow64")
+SHARED_EXTENSIONS = (".dll", ".exe", ".drv", ".sys", ".ocx", ".acm", ".cpl", ".tlb")
+REGISTRY_FILES = ("system.reg", "user.reg", "userdef.reg")
+
+
+def template_path(template_dir, wine_env):
+    """Template prefix matching the WINE build and arch of wine_env"""
+    build = os.path.basename(wine_env['WINEVERPATH'].rstrip('/'))
+    if wine_env['WINEVERPATH'] == '/usr':
+        build = "system"
+    return os.path.join(template_dir, "{}-{}".format(build, wine_env.get('WINEARCH', 'win64')))
+
+
+def build_template(log, template, wine_env):
+    """Create a template prefix with wineboot, recording how long it took"""
+    log.info("Creating template prefix {}".format(template))
+    env = dict(wine_env, WINEPREFIX=template)
+    start = time.monotonic()
+    subprocess.run([wine_env['WINELOADER'], "wineboot", "--init"], env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wineboot returns before the prefix is fully written, wait for its wineserver
+    subprocess.run([wine_env['WINESERVER'], "-w"], env=env)
+    elapsed = time.monotonic() - start
+    if not os.path.isfile(os.path.join(template, "system.reg")):
+        print("Cannot create template prefix {}".format(template))
+        return None
+    info = {"template": template, "wineboot_seconds": round(elapsed, 3), "created": time.time()}
+    with open(os.path.join(template, TEMPLATE_INFO), "w") as info_file:
+        json.dump(info, info_file)
+    return info
+
+
+def read_template_info(template):
+    try:
+        with open(os.path.join(template, TEMPLATE_INFO)) as info_file:
+            return json.load(info_file)
+    except (OSError, ValueError):
+        return None
+
+
+def is_shareable(relpath):
+    """Whether a template file may be hardlinked into prefixes"""
+    return relpath.startswith(SHARED_DIRS) and relpath.lower().endswith(SHARED_EXTENSIONS)
+
+
+def fix_registry(src, dst, template, prefix):
+    """Copy a registry file, pointing the template's paths to the new prefix"""
+    with open(src, encoding="utf-8", errors="surrogateescape") as reg_file:
+        text = reg_file.read()
+    for old, new in ((template, prefix),
+                     (template.replace("/", "\\\\"), prefix.replace("/", "\\\\"))):
+        text = text.replace(old, new)
+    with open(dst, "w", encoding="utf-8", errors="surrogateescape") as reg_file:
+        reg_file.write(text)
+    shutil.copystat(src, dst)
+
+
+def clone_prefix(template, prefix, hardlinks=False):
+    """Clone the template tree into prefix, returning the Cloner with its statistics"""
+    cloner = Cloner(hardlinks)
+    for root, dirs, files in os.walk(template):
+        rel_root = os.path.relpath(root, template)
+        dst_root = os.path.normpath(os.path.join(prefix, rel_root))
+        os.makedirs(dst_root, exist_ok=True)
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_root, name)
+            relpath = os.path.normpath(os.path.join(rel_root, name))
+            if os.path.islink(src):
+                target = os.readlink(src)
+                if target.startswith(template + "/"):
+                    target = prefix + target[len(template):]
+                os.symlink(target, dst)
+                if name in dirs:
+                    dirs.remove(name)
+            elif name in dirs:
+                continue
+            elif relpath == TEMPLATE_INFO:
+                continue
+            elif relpath in REGISTRY_FILES:
+                fix_registry(src, dst, template, prefix)
+            else:
+                cloner.clone(src, dst, is_shareable(relpath))
+        shutil.copystat(root, dst_root)
+    return cloner
+
+
+def protect_shareable(template):
+    """Make the shareable files of a template read-only, if they are not already
+
+    Files shared by hardlink must not be rewritten through a prefix. This is
+    checked before every clone, the template may predate template_hardlinks
+    or have been touched since.
+    """
+    for root, _, files in os.walk(template):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.islink(path) or not is_shareable(os.path.relpath(path, template)):
+                continue
+            mode = os.lstat(path).st_mode
+            if mode & 0o222:
+                os.chmod(path, 0o444)
+
+
+def create_prefix(log, wine_env, template_dir, hardlinks=False):
+    """Create the prefix of wine_env from the template of its WINE build and arch"""
+    prefix = wine_env['WINEPREFIX'].rstrip('/')
+    if os.path.isdir(prefix) and os.listdir(prefix):
+        print("Prefix {} already exists".format(prefix))
+        return 1
+
+    template = template_path(template_dir, wine_env)
+    info = read_template_info(template)
+    if info is None:
+        info = build_template(log, template, wine_env)
+        if info is None:
+            return 1
+
+    start = time.monotonic()
+    if hardlinks:
+        protect_shareable(template)
+    cloner = clone_prefix(template, prefix, hardlinks)
+    elapsed = time.monotonic() - start
+
+    shared = cloner.bytes["reflink"] + cloner.bytes["hardlink"]
+    total = shared + cloner.bytes["copy"]
+    print("Created {} from {} in {:.2f} s ({:.2f} s for wineboot)".format(
+        prefix, template, elapsed, info["wineboot_seconds"]))
+    print("{} files reflinked, {} hardlinked, {} copied; {} of {} bytes not written".format(
+        cloner.files["reflink"], cloner.files["hardlink"], cloner.files["copy"], shared, total))
+    log.info("Created prefix {} in {:.2f} s, saved {:.2f} s and {} bytes".format(
+        prefix, elapsed, info["wineboot_seconds"] - elapsed, shared))
+    return 0
@@ -0,0 +1,102 @@
+import os
+
+# Path prefixes of files that are not worth tracking: pseudo filesystems and devices
+PSEUDO_PATHS = ("/proc/", "/sys/", "/dev/", "/run/", "/tmp/.wine-")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_environ(pid):
+    try:
+        with open("/proc/{}/environ".format(pid), "rb") as environ:
+            return environ.read()
+    except OSError:
+        return None
+
+
+def read_stat(pid):
+    """Fields of /proc/<pid>/stat following the command name, the state first"""
+    try:
+        with open("/proc/{}/stat".format(pid), "rb") as stat:
+            # The command name may hold spaces, the fields start after its closing parenthesis
+            return stat.read().rsplit(b")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+
+def start_time(pid):
+    """Start time of a process in clock ticks, telling apart processes reusing a pid"""
+    fields = read_stat(pid)
+    return int(fields[19]) if fields else None
+
+
+def process_usage(pid):
+    """Resident memory in bytes and CPU time in seconds of a process, None if it is gone"""
+    fields = read_stat(pid)
+    if not fields:
+        return None
+    return (int(fields[21]) * PAGE_SIZE,
+            (int(fields[11]) + int(fields[12])) / CLOCK_TICKS)
+
+
+class WineProcesses:
+    """Find the processes running in a WINEPREFIX, wineserver included
+
+    A process belongs to the prefix when its environment holds the prefix's
+    WINEPREFIX; the outcome is remembered per pid and start time, so only new
+    processes are inspected on later scans.
+    """
+
+    def __init__(self, prefix):
+        self.marker = b"\0WINEPREFIX=" + os.fsencode(prefix) + b"\0"
+        self.uid = os.getuid()
+        self.known = {}
+
+    def pids(self):
+        found = []
+        known = {}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            key = (pid, start_time(pid))
+            if key in self.known:
+                member = self.known[key]
+            else:
+                try:
+                    owned = os.stat("/proc/" + name).st_uid == self.uid
+                except OSError:
+                    continue
+                environ = read_environ(pid) if owned else None
+                member = environ is not None and self.marker in b"\0" + environ + b"\0"
+            known[key] = member
+            if member:
+                found.append(pid)
+        self.known = known
+        return found
+
+
+def open_files(pid):
+    """Regular files a process has open or mapped"""
+    files = set()
+    fd_dir = "/proc/{}/fd".format(pid)
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError:
+        fds = []
+    for fd in fds:
+        try:
+            files.add(os.readlink(os.path.join(fd_dir, fd)))
+        except OSError:
+            continue
+    try:
+        with open("/proc/{}/maps".format(pid)) as maps:
+            for line in maps:
+                fields = line.split(None, 5)
+                if len(fields) == 6:
+                    files.add(fields[5].rstrip("\n"))
+    except OSError:
+        pass
+    return {path for path in files
+            if path.startswith("/") and not path.startswith(PSEUDO_PATHS)
+            and not path.endswith(" (deleted)")}
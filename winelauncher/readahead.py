@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+import time
+
+from winelauncher.cache import cache_dir, read_json, write_json
+from winelauncher.procfs import WineProcesses, open_files
+
+# Seconds between two samples of the open files of the WINE processes
+SAMPLE_INTERVAL = 0.1
+READAHEAD_WORKERS = 8
+
+
+def profile_path(prefix, wine_exec):
+    """Readahead profile of a command in a prefix"""
+    key = hashlib.sha1("\0".join([prefix] + list(wine_exec)).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), "readahead", key + ".json")
+
+
+class ProfileRecorder:
+    """Record the files the WINE processes of a prefix open, in the order they first appear"""
+
+    def __init__(self, prefix, interval=SAMPLE_INTERVAL):
+        self.processes = WineProcesses(prefix)
+        self.interval = interval
+        self.files = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            for pid in self.processes.pids():
+                for path in open_files(pid):
+                    self.files.setdefault(path, len(self.files))
+            self.samples += 1
+            if self.stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        """Stop sampling, returning the regular files seen, in order"""
+        self.stopped.set()
+        self.thread.join()
+        return [path for path in sorted(self.files, key=self.files.get) if os.path.isfile(path)]
+
+
+def save_profile(path, files, first_output):
+    size = 0
+    for file in files:
+        try:
+            size += os.path.getsize(file)
+        except OSError:
+            continue
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json(path, {"files": files,
+                      "size": size,
+                      "first_output": first_output,
+                      "recorded": time.time()})
+
+
+def load_profile(path):
+    return read_json(path)
+
+
+def willneed(path):
+    """Ask the kernel to read a whole file into the page cache"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+def start_readahead(files, workers=READAHEAD_WORKERS):
+    """Read the files ahead in a detached process, alongside the WINE startup
+
+    The process is detached with a double fork, so neither the launcher nor
+    WINE replacing it in exec mode has to reap it.
+    """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        if os.fork() == 0:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(willneed, files))
+    finally:
+        os._exit(0)
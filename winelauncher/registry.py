@@ -0,0 +1,286 @@
+import os
+import re
+import shutil
+import time
+
+from winelauncher.wineserver import server_running
+
+# Registry files holding each root key, paths in the files are relative to them
+HIVES = {
+    "HKEY_LOCAL_MACHINE": "system.reg",
+    "HKLM": "system.reg",
+    "HKEY_CURRENT_USER": "user.reg",
+    "HKCU": "user.reg",
+}
+# The default user profile, copied for new users, lives in userdef.reg
+USERS_ROOTS = ("HKEY_USERS", "HKU")
+DEFAULT_USER = ".DEFAULT"
+# Seconds between the FILETIME epoch (1601) and the unix epoch
+FILETIME_EPOCH = 11644473600
+ESCAPES = {"\a": "a", "\b": "b", "\t": "t", "\n": "n", "\v": "v", "\f": "f", "\r": "r", "\x1b": "e"}
+UNESCAPES = {code: char for char, code in ESCAPES.items()}
+HEX_DIGITS = "0123456789abcdefABCDEF"
+DWORD_RE = re.compile(r"dword:([0-9a-fA-F]{1,8})$")
+
+
+def escape(text, special):
+    """Escape a key or value name the way wineserver writes it"""
+    units = text.encode("utf-16-le")
+    chars = [int.from_bytes(units[i:i + 2], "little") for i in range(0, len(units), 2)]
+    out = []
+    for pos, char in enumerate(chars):
+        following = chr(chars[pos + 1]) if pos + 1 < len(chars) else ""
+        if chr(char) in ESCAPES:
+            out.append("\\" + ESCAPES[chr(char)])
+        elif char < 32:
+            out.append(("\\{:03o}" if following and following in "01234567" else "\\{:o}").format(char))
+        elif char > 127:
+            out.append(("\\x{:04x}" if following and following in HEX_DIGITS else "\\x{:x}").format(char))
+        elif chr(char) == "\\" or chr(char) in special:
+            out.append("\\" + chr(char))
+        else:
+            out.append(chr(char))
+    return "".join(out)
+
+
+def unescape(text, end):
+    """Unescape text up to the unescaped end character, returning it and the rest of the text"""
+    units = []
+    pos = 0
+    while pos < len(text) and text[pos] != end:
+        char = text[pos]
+        pos += 1
+        if char != "\\" or pos == len(text):
+            units.append(ord(char))
+            continue
+        char = text[pos]
+        pos += 1
+        if char in UNESCAPES:
+            units.append(ord(UNESCAPES[char]))
+        elif char == "x":
+            digits = 0
+            while digits < 4 and pos + digits < len(text) and text[pos + digits] in HEX_DIGITS:
+                digits += 1
+            units.append(int(text[pos:pos + digits], 16) if digits else ord("x"))
+            pos += digits
+        elif char in "01234567":
+            digits = 1
+            while digits < 3 and pos + digits - 1 < len(text) and text[pos + digits - 1] in "01234567":
+                digits += 1
+            units.append(int(text[pos - 1:pos + digits - 1], 8))
+            pos += digits - 1
+        else:
+            units.append(ord(char))
+    data = b"".join(unit.to_bytes(2, "little") for unit in units if unit <= 0xffff)
+    return data.decode("utf-16-le", "surrogatepass"), text[pos + 1:]
+
+
+def format_value(name, value):
+    """Render a value line, strings as REG_SZ and integers as REG_DWORD"""
+    line = '"{}"='.format(escape(name, '"')) if name else "@="
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("unsupported registry value {!r}".format(value))
+    if isinstance(value, int):
+        return line + "dword:{:08x}\n".format(value & 0xffffffff)
+    return line + '"{}"\n'.format(escape(value, '"'))
+
+
+def parse_value(data):
+    """Value of the data part of a value line: a string, an integer for dwords, else raw"""
+    data = data.rstrip("\n")
+    if data.startswith('"'):
+        return unescape(data[1:], '"')[0]
+    match = DWORD_RE.match(data)
+    if match:
+        return int(match.group(1), 16)
+    return data
+
+
+class RegistryKey:
+    """A key section of a registry file, its value lines parsed only when needed"""
+
+    def __init__(self, name, lines):
+        self.name = name
+        self.lines = lines
+        self.entries = None
+        self.modified = False
+
+    def parse(self):
+        """Split the section into entries: [lowercase value name or None, raw text]"""
+        if self.entries is not None:
+            return self.entries
+        self.entries = []
+        continued = False
+        for line in self.lines[1:]:
+            if continued:
+                self.entries[-1][1] += line
+            elif line.startswith('"'):
+                name, rest = unescape(line[1:], '"')
+                self.entries.append([name.lower() if rest.startswith("=") else None, line])
+            elif line.startswith("@="):
+                self.entries.append(["", line])
+            else:
+                self.entries.append([None, line])
+            # Hex values continue on the next line after a trailing backslash
+            continued = line.rstrip("\n").endswith("\\") and self.entries[-1][0] is not None
+        return self.entries
+
+    def get(self, name):
+        for entry_name, text in self.parse():
+            if entry_name == name.lower():
+                data = unescape(text[1:], '"')[1] if name else text[1:]
+                return parse_value(data[1:])
+        return None
+
+    def set(self, name, value):
+        """Set or, with value None, delete a value; returns whether the key changed"""
+        entries = self.parse()
+        for pos, (entry_name, text) in enumerate(entries):
+            if entry_name == name.lower():
+                if value is None:
+                    del entries[pos]
+                elif text == format_value(name, value):
+                    return False
+                else:
+                    entries[pos] = [entry_name, format_value(name, value)]
+                self.modified = True
+                return True
+        if value is None:
+            return False
+        # Keep the blank lines separating the section from the next one at the end
+        pos = len(entries)
+        while pos and entries[pos - 1][1].strip() == "":
+            pos -= 1
+        entries.insert(pos, [name.lower(), format_value(name, value)])
+        self.modified = True
+        return True
+
+    def render(self):
+        if not self.modified:
+            return "".join(self.lines)
+        now = time.time()
+        lines = ["[{}] {}\n".format(escape(self.name, "[]"), int(now)),
+                 "#time={:x}\n".format(int((now + FILETIME_EPOCH) * 10000000))]
+        lines.extend(text for _, text in self.entries if not text.startswith("#time="))
+        return "".join(lines)
+
+
+class RegistryFile:
+    """A WINE registry file (system.reg, user.reg, userdef.reg) edited without wineserver
+
+    The file is split into key sections in a single pass; untouched sections are
+    written back byte for byte, modified ones with a fresh timestamp.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = []
+        self.keys = []
+        self.positions = {}
+        with open(path, encoding="utf-8", errors="surrogateescape", newline="") as reg_file:
+            lines = self.header
+            for line in reg_file:
+                if line.startswith("["):
+                    name, _ = unescape(line[1:], "]")
+                    lines = [line]
+                    self.positions[name.lower()] = len(self.keys)
+                    self.keys.append(RegistryKey(name, lines))
+                else:
+                    lines.append(line)
+
+    @property
+    def modified(self):
+        return any(key.modified for key in self.keys)
+
+    def key(self, name, create=False):
+        pos = self.positions.get(name.lower())
+        if pos is not None:
+            return self.keys[pos]
+        if not create:
+            return None
+        # Keys are separated by a blank line
+        if self.keys:
+            last = self.keys[-1]
+            entries = last.parse()
+            if not entries or entries[-1][1].strip():
+                last.lines.append("\n")
+                last.entries.append([None, "\n"])
+        elif self.header and self.header[-1].strip():
+            self.header.append("\n")
+        key = RegistryKey(name, ["[{}]\n".format(escape(name, "[]"))])
+        key.entries = []
+        self.positions[name.lower()] = len(self.keys)
+        self.keys.append(key)
+        return key
+
+    def get(self, key, name):
+        section = self.key(key)
+        return section.get(name) if section else None
+
+    def set(self, key, name, value):
+        """Set a value, creating its key; value None deletes it. Returns whether it changed"""
+        section = self.key(key, create=value is not None)
+        return section.set(name, value) if section else False
+
+    def save(self):
+        """Atomically replace the registry file, keeping its permissions"""
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8", errors="surrogateescape", newline="") as reg_file:
+            reg_file.write("".join(self.header))
+            for key in self.keys:
+                reg_file.write(key.render())
+        shutil.copymode(self.path, tmp_path)
+        os.replace(tmp_path, self.path)
+
+
+def split_key(path):
+    """Registry file and relative key of a key path, HKEY_CURRENT_USER by default
+
+    HKEY_USERS\\.Default maps to userdef.reg; ValueError is raised for the
+    other users, whose hives are not files of the prefix.
+    """
+    root, _, rest = path.partition("\\")
+    if root.upper() in HIVES:
+        return HIVES[root.upper()], rest
+    if root.upper() in USERS_ROOTS:
+        user, _, rest = rest.partition("\\")
+        if user.upper() == DEFAULT_USER:
+            return "userdef.reg", rest
+        raise ValueError("only the .Default user of {} can be set".format(root))
+    return "user.reg", path
+
+
+def apply_settings(log, prefix, settings):
+    """Write registry settings, {file: {key: {name: value}}}, into a prefix
+
+    Nothing is written while a wineserver runs for the prefix, as it would
+    overwrite the files with its own copy of the registry. Returns whether the
+    prefix registry holds the settings.
+    """
+    start = time.monotonic()
+    if not os.path.isfile(os.path.join(prefix, "system.reg")):
+        log.debug("Prefix {} not created yet, skipping the registry settings".format(prefix))
+        return False
+    pending = []
+    for hive, keys in settings.items():
+        try:
+            registry = RegistryFile(os.path.join(prefix, hive))
+        except OSError as err:
+            log.warning("Cannot read registry file {}: {}".format(hive, err))
+            return False
+        for key, values in keys.items():
+            for name, value in values.items():
+                registry.set(key, name, value)
+        if registry.modified:
+            pending.append(registry)
+    if not pending:
+        log.debug("Registry settings of {} up to date".format(prefix))
+        return True
+    if server_running(prefix):
+        log.warning("wineserver of {} is running, registry settings not applied".format(prefix))
+        return False
+    for registry in pending:
+        registry.save()
+    log.info("Registry settings written to {} in {:.1f} ms".format(
+        ", ".join(registry.path for registry in pending), (time.monotonic() - start) * 1000))
+    return True
@@ -0,0 +1,107 @@
+import glob
+import os
+
+from winelauncher.cache import read_json, write_json
+
+# Cache location variables of each driver or translation layer, with their subdirectory
+SHADER_VARIABLES = {
+    "DXVK_STATE_CACHE_PATH": "dxvk",
+    "MESA_SHADER_CACHE_DIR": "mesa",
+    "__GL_SHADER_DISK_CACHE_PATH": "nvidia",
+}
+# The NVIDIA driver trims its cache on its own unless told otherwise
+NVIDIA_VARIABLES = {"__GL_SHADER_DISK_CACHE": "1", "__GL_SHADER_DISK_CACHE_SKIP_CLEANUP": "1"}
+STATS_FILE = ".winelauncher-stats.json"
+
+
+def gpu_driver():
+    """Identify the GPU driver: the NVIDIA version, else the DRM kernel drivers in use"""
+    try:
+        with open("/sys/module/nvidia/version") as version:
+            return "nvidia-" + version.read().strip()
+    except OSError:
+        pass
+    drivers = set()
+    for link in glob.glob("/sys/class/drm/card[0-9]*/device/driver"):
+        try:
+            drivers.add(os.path.basename(os.readlink(link)))
+        except OSError:
+            continue
+    return "-".join(sorted(drivers)) or "unknown"
+
+
+def cache_path(base, mode, wine_env):
+    """Shader cache directory of a launch, shared by WINE build and GPU driver or per prefix"""
+    if mode == "prefix":
+        return os.path.join(base, "prefix", os.path.basename(wine_env['WINEPREFIX'].rstrip('/')))
+    build = os.path.basename(wine_env['WINEVERPATH'].rstrip('/'))
+    if wine_env['WINEVERPATH'] == '/usr':
+        build = "system"
+    return os.path.join(base, "{}-{}".format(build, gpu_driver()))
+
+
+def setup_shader_cache(log, wine_env, base, mode):
+    """Point the shader caches of WINE at the managed cache, keeping variables the user set"""
+    path = cache_path(base, mode, wine_env)
+    for variable, subdir in SHADER_VARIABLES.items():
+        if variable not in wine_env:
+            os.makedirs(os.path.join(path, subdir), exist_ok=True)
+            wine_env[variable] = os.path.join(path, subdir)
+    for variable, value in NVIDIA_VARIABLES.items():
+        wine_env.setdefault(variable, value)
+    log.info("Shader cache: {}".format(path))
+    return path
+
+
+def cache_files(base):
+    """List the files of the managed cache as (last use, size, path)"""
+    files = []
+    for root, _, names in os.walk(base):
+        for name in names:
+            if name == STATS_FILE:
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            files.append((max(st.st_atime, st.st_mtime), st.st_blocks * 512, path))
+    return files
+
+
+def maintain_shader_cache(log, wine_env, base, mode, limit):
+    """Report the growth of the launch's cache, then evict the least recently used files over limit"""
+    path = os.path.join(cache_path(base, mode, wine_env), "")
+    files = cache_files(base)
+    total = sum(size for _, size, _ in files)
+    size = sum(size for _, size, file_path in files if file_path.startswith(path))
+
+    stats_path = os.path.join(base, STATS_FILE)
+    stats = read_json(stats_path, {})
+    sizes = stats.get("sizes", {})
+    previous = sizes.get(path)
+    if previous is None:
+        log.info("Shader cache {} holds {} bytes".format(path, size))
+    else:
+        log.info("Shader cache {} holds {} bytes, {:+d} since the previous launch".format(
+            path, size, size - previous))
+
+    if limit and total > limit:
+        evicted = 0
+        freed = 0
+        for _, file_size, file_path in sorted(files):
+            if total - freed <= limit:
+                break
+            try:
+                os.unlink(file_path)
+            except OSError:
+                continue
+            evicted += 1
+            freed += file_size
+            if file_path.startswith(path):
+                size -= file_size
+        log.info("Shader cache over {} bytes, evicted {} files ({} bytes)".format(
+            limit, evicted, freed))
+
+    sizes[path] = size
+    write_json(stats_path, {"sizes": sizes})
@@ -0,0 +1,49 @@
+"""Apply scheduling and resource settings to this process, then exec a command
+
+    python tunedexec.py SETTINGS COMMAND [ARGS...]
+
+SETTINGS is the JSON object built by tuning.tuning_command. The launcher
+starts WINE through this wrapper instead of a preexec function: running
+Python code between fork and exec may deadlock when the launcher has
+threads. Only the standard library is imported, so it starts fast when run
+as a script.
+"""
+import json
+import os
+import resource
+import sys
+
+
+def apply_tuning(settings):
+    """Apply settings resolved by tuning.tuning_command to the current process"""
+    if settings.get("affinity"):
+        os.sched_setaffinity(0, settings["affinity"])
+    if settings.get("nice") is not None:
+        os.setpriority(os.PRIO_PROCESS, 0, settings["nice"])
+    if settings.get("ioprio"):
+        import ctypes
+        # Best effort, as ionice: the I/O class is a hint
+        ctypes.CDLL(None).syscall(*settings["ioprio"])
+    for limit, soft, hard in settings.get("rlimits", []):
+        resource.setrlimit(limit, (soft, hard))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("usage: tunedexec.py SETTINGS COMMAND [ARGS...]", file=sys.stderr)
+        sys.exit(2)
+    try:
+        apply_tuning(json.loads(argv[0]))
+    except (OSError, ValueError) as err:
+        print("winelauncher: cannot apply the prefix tuning: {}".format(err), file=sys.stderr)
+        sys.exit(1)
+    try:
+        os.execvp(argv[1], argv[1:])
+    except OSError as err:
+        print("winelauncher: cannot execute {}: {}".format(argv[1], err), file=sys.stderr)
+        sys.exit(127)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import json
+import os
+import resource
+import sys
+
+from winelauncher.functions import lookup, lookup_choice, lookup_int, parse_size
+
+IOPRIO_CLASSES = {"none": 0, "realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+# ioprio_set syscall numbers, by machine
+IOPRIO_SET = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314}
+RLIMITS = {"rlimit_nofile": "RLIMIT_NOFILE", "rlimit_memlock": "RLIMIT_MEMLOCK"}
+# Capability bits, from linux/capability.h
+CAP_SYS_ADMIN = 21
+CAP_SYS_NICE = 23
+CAP_SYS_RESOURCE = 24
+# Ceiling of RLIMIT_NOFILE, even with CAP_SYS_RESOURCE, and its default value
+NR_OPEN_PATH = "/proc/sys/fs/nr_open"
+DEFAULT_NR_OPEN = 1048576
+
+
+def parse_cpu_list(value):
+    """Parse a CPU list such as 0-3,8 into sorted CPU numbers"""
+    cpus = set()
+    for part in value.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def parse_limit(value):
+    """Parse a limit: a number with an optional K, M or G suffix, or unlimited"""
+    value = value.strip().lower()
+    if value in ("unlimited", "infinity"):
+        return resource.RLIM_INFINITY
+    return parse_size(value)
+
+
+def nr_open():
+    """Highest RLIMIT_NOFILE the kernel accepts"""
+    try:
+        with open(NR_OPEN_PATH) as nr_open_file:
+            return int(nr_open_file.read())
+    except (OSError, ValueError):
+        return DEFAULT_NR_OPEN
+
+
+def parse_tuning(config, config_section):
+    """Read and validate the scheduling and resource settings of a prefix section
+
+    Returns a dict with the affinity, nice, ioprio and rlimits keys set by the
+    section, exiting with an error on invalid values.
+    """
+    tuning = {}
+    option = None
+    try:
+        option = 'cpu_affinity'
+        value = lookup(config, config_section, option)
+        if value:
+            tuning['affinity'] = parse_cpu_list(value)
+        option = 'nice'
+        value = lookup(config, config_section, option)
+        if value:
+            tuning['nice'] = int(value)
+            if not -20 <= tuning['nice'] <= 19:
+                raise ValueError
+        ioprio_class = lookup_choice(config, config_section, 'ioprio_class',
+                                     tuple(IOPRIO_CLASSES), None)
+        if ioprio_class:
+            option = 'ioprio_level'
+            level = lookup_int(config, config_section, option, 4)
+            if not 0 <= level <= 7:
+                raise ValueError
+            tuning['ioprio'] = [ioprio_class, level]
+        for option, limit in sorted(RLIMITS.items()):
+            value = lookup(config, config_section, option)
+            if value:
+                soft, _, hard = value.partition(":")
+                soft, hard = parse_limit(soft), parse_limit(hard or soft)
+                if hard != resource.RLIM_INFINITY and (soft == resource.RLIM_INFINITY
+                                                       or soft > hard):
+                    raise ValueError
+                if limit == "RLIMIT_NOFILE":
+                    # setrlimit fails above fs.nr_open, unlimited included
+                    ceiling = nr_open()
+                    soft, hard = [ceiling if value == resource.RLIM_INFINITY
+                                  else min(value, ceiling) for value in (soft, hard)]
+                tuning.setdefault('rlimits', {})[limit] = [soft, hard]
+    except ValueError:
+        print("Invalid {} value for {}: {}".format(option, config_section,
+                                                   lookup(config, config_section, option)))
+        sys.exit(1)
+    return tuning
+
+
+def describe_tuning(tuning):
+    details = []
+    if 'affinity' in tuning:
+        details.append("cpus {}".format(",".join(str(cpu) for cpu in tuning['affinity'])))
+    if 'nice' in tuning:
+        details.append("nice {}".format(tuning['nice']))
+    if 'ioprio' in tuning:
+        details.append("ioprio {} {}".format(*tuning['ioprio']))
+    for limit, (soft, hard) in sorted(tuning.get('rlimits', {}).items()):
+        details.append("{} {}:{}".format(limit[7:].lower(),
+                                         "unlimited" if soft == resource.RLIM_INFINITY else soft,
+                                         "unlimited" if hard == resource.RLIM_INFINITY else hard))
+    return ", ".join(details)
+
+
+def effective_capabilities():
+    """Effective capability set of this process, as a bit mask"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("CapEff:"):
+                    return int(line.split()[1], 16)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def capped_rlimit(limit, soft, hard, capabilities=None):
+    """Limits as this process may set them, capped to its hard limit without CAP_SYS_RESOURCE
+
+    Returns the soft and hard limits, and whether they were capped.
+    """
+    if capabilities is None:
+        capabilities = effective_capabilities()
+    current_hard = resource.getrlimit(getattr(resource, limit))[1]
+    if not capabilities & (1 << CAP_SYS_RESOURCE) and current_hard != resource.RLIM_INFINITY and (
+            hard == resource.RLIM_INFINITY or hard > current_hard):
+        soft = current_hard if soft == resource.RLIM_INFINITY else min(soft, current_hard)
+        return soft, current_hard, True
+    return soft, hard, False
+
+
+def effective_tuning(log, tuning):
+    """Drop or clamp the settings this process is not allowed to apply, with a warning"""
+    tuning = dict(tuning)
+    capabilities = effective_capabilities()
+    if 'affinity' in tuning:
+        allowed = os.sched_getaffinity(0)
+        cpus = [cpu for cpu in tuning['affinity'] if cpu in allowed]
+        if cpus != tuning['affinity']:
+            log.warning("CPUs {} not available, ignoring them".format(
+                ",".join(str(cpu) for cpu in tuning['affinity'] if cpu not in allowed)))
+        if cpus:
+            tuning['affinity'] = cpus
+        else:
+            del tuning['affinity']
+    if 'nice' in tuning and not capabilities & (1 << CAP_SYS_NICE):
+        # Raising the nice value is always allowed, RLIMIT_NICE allows lowering it down to 20 - limit
+        limit = resource.getrlimit(resource.RLIMIT_NICE)[0]
+        floor = -20 if limit == resource.RLIM_INFINITY else max(-20, 20 - limit)
+        floor = min(os.getpriority(os.PRIO_PROCESS, 0), floor)
+        if tuning['nice'] < floor:
+            log.warning("Not allowed to set nice {}, using {}".format(tuning['nice'], floor))
+            tuning['nice'] = floor
+    if ('ioprio' in tuning and tuning['ioprio'][0] == "realtime"
+            and not capabilities & (1 << CAP_SYS_ADMIN)):
+        log.warning("The realtime I/O class needs CAP_SYS_ADMIN, ignoring ioprio_class")
+        del tuning['ioprio']
+    if 'ioprio' in tuning and os.uname().machine not in IOPRIO_SET:
+        log.warning("ioprio_set not supported on {}".format(os.uname().machine))
+        del tuning['ioprio']
+    rlimits = {}
+    for limit, (soft, hard) in tuning.get('rlimits', {}).items():
+        soft, hard, capped = capped_rlimit(limit, soft, hard, capabilities)
+        if capped:
+            log.warning("{} hard limit capped to {}".format(limit, hard))
+        rlimits[limit] = [soft, hard]
+    if rlimits:
+        tuning['rlimits'] = rlimits
+    return tuning
+
+
+def tuning_command(log, tuning):
+    """Command prefix starting a program with the tuning applied, empty if no tuning
+
+    The settings are resolved here, in the launcher, and applied by the
+    tunedexec wrapper in the new process before it execs the program.
+    """
+    tuning = effective_tuning(log, tuning)
+    if not tuning:
+        return []
+    log.info("Tuning: {}".format(describe_tuning(tuning)))
+    settings = {
+        "affinity": tuning.get('affinity'),
+        "nice": tuning.get('nice'),
+        "rlimits": [[getattr(resource, limit), soft, hard]
+                    for limit, (soft, hard) in sorted(tuning.get('rlimits', {}).items())],
+    }
+    if 'ioprio' in tuning:
+        ioprio = (IOPRIO_CLASSES[tuning['ioprio'][0]] << IOPRIO_CLASS_SHIFT) | tuning['ioprio'][1]
+        settings["ioprio"] = [IOPRIO_SET[os.uname().machine], IOPRIO_WHO_PROCESS, 0, ioprio]
+    from winelauncher import tunedexec
+    return [sys.executable, "-E", "-s", os.path.abspath(tunedexec.__file__),
+            json.dumps(settings, separators=(",", ":"))]
@@ -0,0 +1,141 @@
+import re
+import time
+
+# [timestamp:][pid:]tid:class:channel:function message
+DEBUG_LINE_RE = re.compile(
+    r"(?:\d+\.\d+:)?(?:(?P<pid>[0-9a-f]{4,8}):)?(?:(?P<tid>[0-9a-f]{4,8}):)?"
+    r"(?P<cls>trace|fixme|err|warn):(?P<channel>[\w-]+):(?P<function>\S+?) (?P<message>.*)")
+# Distinct messages remembered between two summaries
+DEDUP_KEYS = 4096
+# Parsed lines remembered, repeated lines are usually byte for byte identical
+PARSE_CACHE = 16384
+
+
+def parse_line(line):
+    """Split a WINE debug line into its fields, None if it is not one"""
+    match = DEBUG_LINE_RE.match(line)
+    if not match:
+        return None
+    fields = match.groupdict()
+    if fields["pid"] and not fields["tid"]:
+        fields["tid"], fields["pid"] = fields["pid"], None
+    fields["key"] = (fields["cls"], fields["channel"], fields["function"], fields["message"])
+    return fields
+
+
+def journal_fields(fields):
+    """Journal fields of a parsed debug line"""
+    journal = {
+        "WINE_CLASS": fields["cls"],
+        "WINE_CHANNEL": fields["channel"],
+        "WINE_FUNCTION": fields["function"],
+    }
+    if fields["tid"]:
+        journal["WINE_TID"] = fields["tid"]
+    if fields["pid"]:
+        journal["WINE_PID"] = fields["pid"]
+    return journal
+
+
+class TokenBucket:
+    """Allow rate events per second on average, with bursts of up to burst"""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+        self.dropped = 0
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.dropped += 1
+        return False
+
+
+class WineDebugFilter:
+    """Parse, deduplicate and rate limit WINE debug output
+
+    Repeats of a debug message are suppressed and reported as a single
+    "repeated N times" line every summary_interval seconds; with a rate,
+    each debug channel is limited to rate lines per second (bursts of
+    burst lines). Lines that are not WINE debug messages pass through.
+    """
+
+    def __init__(self, dedup=True, rate=0, burst=0, summary_interval=10, structured=False,
+                 clock=time.monotonic):
+        self.dedup = dedup
+        self.rate = rate
+        self.burst = max(burst, rate, 1)
+        self.summary_interval = summary_interval
+        self.structured = structured
+        self.clock = clock
+        self.repeats = {}
+        self.buckets = {}
+        self.parsed = {}
+        self.next_summary = clock() + summary_interval
+
+    def process(self, lines):
+        """Filter a batch of lines, returning the lines to log and their journal fields"""
+        now = self.clock()
+        out_lines = []
+        out_fields = []
+        parsed = self.parsed
+        for line in lines:
+            if line in parsed:
+                fields = parsed[line]
+            else:
+                if len(parsed) >= PARSE_CACHE:
+                    parsed.clear()
+                fields = parsed[line] = parse_line(line)
+            if fields is None:
+                out_lines.append(line)
+                out_fields.append(None)
+                continue
+            if self.dedup:
+                key = fields["key"]
+                if key in self.repeats:
+                    self.repeats[key] += 1
+                    continue
+                if len(self.repeats) < DEDUP_KEYS:
+                    self.repeats[key] = 0
+            if self.rate:
+                bucket = self.buckets.get(fields["channel"])
+                if bucket is None:
+                    bucket = self.buckets[fields["channel"]] = TokenBucket(self.rate, self.burst, now)
+                if not bucket.take(now):
+                    continue
+            out_lines.append(line)
+            out_fields.append(journal_fields(fields) if self.structured else None)
+        if now >= self.next_summary:
+            self._summarize(out_lines, out_fields)
+        return out_lines, out_fields
+
+    def flush(self):
+        """Return the pending summaries, for when the output ends"""
+        out_lines = []
+        out_fields = []
+        self._summarize(out_lines, out_fields)
+        return out_lines, out_fields
+
+    def _summarize(self, out_lines, out_fields):
+        for key, count in self.repeats.items():
+            if count:
+                out_lines.append("{}:{}:{} {} (repeated {} times)".format(*key, count))
+                out_fields.append({"WINE_CLASS": key[0], "WINE_CHANNEL": key[1],
+                                   "WINE_FUNCTION": key[2], "WINE_REPEATED": count}
+                                  if self.structured else None)
+        # Messages not seen again since the last summary are logged again next time
+        self.repeats = {key: 0 for key, count in self.repeats.items() if count}
+        for channel, bucket in self.buckets.items():
+            if bucket.dropped:
+                out_lines.append("{} debug channel over {} lines/s, dropped {} lines".format(
+                    channel, self.rate, bucket.dropped))
+                out_fields.append({"WINE_CHANNEL": channel, "WINE_DROPPED": bucket.dropped}
+                                  if self.structured else None)
+                bucket.dropped = 0
+        self.next_summary = self.clock() + self.summary_interval
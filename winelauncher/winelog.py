@@ -1,6 +1,150 @@
 import logging
+import queue
+import threading
 
-from systemd import journal
+
+# Placeholder message used to format a batch of lines with a single record
+LINE_MARK = "\x00winelauncher-line\x00"
+# Queue items drained by the sink writer before flushing its destination
+SINK_BATCH = 64
+OVERFLOW_POLICIES = ("block", "drop")
+
+
+class BatchStreamMixin:
+    """ Write a batch of lines sharing one record with a single write and flush """
+
+    def emit_lines(self, record, lines, fields=None, flush=True):
+        if self.filters and not self.filter(record):
+            return
+        try:
+            head, _, tail = self.format(record).partition(LINE_MARK)
+            separator = tail + self.terminator + head
+            text = head + separator.join(lines) + tail + self.terminator
+            self.acquire()
+            try:
+                self.stream.write(text)
+                if flush:
+                    self.flush()
+            finally:
+                self.release()
+        except Exception:
+            self.handleError(record)
+
+
+class BatchStreamHandler(BatchStreamMixin, logging.StreamHandler):
+    pass
+
+
+class BatchFileHandler(BatchStreamMixin, logging.FileHandler):
+    pass
+
+
+class QueueSinkHandler(logging.Handler):
+    """ Hand records to a background writer through a bounded queue
+
+    The pump thread only enqueues: the destination handler is driven by the
+    writer thread, which drains the queue in batches and flushes once per
+    batch. When the queue is full records are either waited on ("block") or
+    discarded and counted ("drop").
+    """
+
+    def __init__(self, target, size, overflow="block"):
+        super().__init__()
+        self.target = target
+        self.overflow = overflow
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = 0
+        self.written = 0
+        self._writer = threading.Thread(target=self._drain, name="winelauncher-log-sink",
+                                        daemon=True)
+        self._writer.start()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def _enqueue(self, item, count):
+        if self.overflow == "drop":
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += count
+        else:
+            self.queue.put(item)
+
+    def emit(self, record):
+        self._enqueue((record, None, None), 1)
+
+    def emit_lines(self, record, lines, fields=None):
+        self._enqueue((record, lines, fields), len(lines))
+
+    def _write(self, record, lines, fields):
+        if lines is None:
+            self.target.handle(record)
+            self.written += 1
+        elif hasattr(self.target, "emit_lines"):
+            self.target.emit_lines(record, lines, flush=False)
+            self.written += len(lines)
+        else:
+            for line_record in line_records(record, lines, fields):
+                self.target.handle(line_record)
+            self.written += len(lines)
+
+    def _drain(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < SINK_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                try:
+                    self._write(*item)
+                except Exception:
+                    self.handleError(item[0])
+            try:
+                self.target.flush()
+            except Exception:
+                pass
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        if self._writer.is_alive():
+            self.queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self.queue.put(None)
+            self._writer.join()
+            if self.dropped:
+                self.target.handle(logging.makeLogRecord({
+                    "name": "winelauncher",
+                    "levelno": logging.WARNING,
+                    "levelname": logging.getLevelName(logging.WARNING),
+                    "msg": "Log sink overloaded, dropped {} of {} records".format(
+                        self.dropped, self.dropped + self.written),
+                }))
+            self.target.close()
+        super().close()
+
+
+def line_records(record, lines, fields=None):
+    """ Expand a batch record into one record per line, with the line's own fields """
+    base = record.__dict__
+    if fields is None:
+        return [logging.makeLogRecord(dict(base, msg=line)) for line in lines]
+    records = []
+    for line, line_fields in zip(lines, fields):
+        attrs = dict(base, msg=line)
+        if line_fields:
+            attrs.update(line_fields)
+        records.append(logging.makeLogRecord(attrs))
+    return records
 
 
 def set_log_level(level):
@@ -16,25 +160,56 @@ def set_log_level(level):
     return set_level.get(level, logging.INFO)
 
 
-def logger_init(tag, dest, level):
-    """ Initialize the logger """
+def logger_init(tag, dest, level, queue_size=0, overflow="block"):
+    """ Initialize the logger
+
+    With a queue_size, journal and file destinations are written by a
+    background thread through a queue of at most queue_size batches.
+    """
     logger = logging.getLogger("winelauncher")
     logger.setLevel(set_log_level(level))
 
     if dest == "journal":
+        from systemd import journal
         log_handler = journal.JournalHandler(SYSLOG_IDENTIFIER=tag)
         log_format = logging.Formatter("%(levelname)-8s - %(message)s")
     elif dest == "console":
-        log_handler = logging.StreamHandler()
+        log_handler = BatchStreamHandler()
         log_format = logging.Formatter("%(asctime)s - %(levelname)-8s - %(message)s")
     else:
         try:
-            log_handler = logging.FileHandler(dest)
+            log_handler = BatchFileHandler(dest)
             log_format = logging.Formatter("%(asctime)s %(levelname)-8s {} %(message)s".format(tag))
         except OSError as err:
             print("Cannot open file {}".format(dest))
             print("OSError: {0}".format(err))
 
+    if queue_size and dest != "console":
+        log_handler = QueueSinkHandler(log_handler, queue_size, overflow)
     log_handler.setFormatter(log_format)
     logger.addHandler(log_handler)
     return logger
+
+
+def log_lines(logger, stream, lines, level=logging.INFO, fields=None):
+    """ Log a batch of WINE output lines, tagged with the stream they came from
+
+    fields optionally holds, for each line, extra record attributes (journal
+    fields) or None.
+    """
+    if not logger.isEnabledFor(level) or not lines:
+        return
+    # Build the record directly, skipping the caller lookup of Logger.info
+    batch_record = logger.makeRecord(logger.name, level, "(wine)", 0, LINE_MARK, None, None,
+                                     extra={"WINE_STREAM": stream})
+    records = None
+    for handler in logger.handlers:
+        if level < handler.level:
+            continue
+        if hasattr(handler, "emit_lines"):
+            handler.emit_lines(batch_record, lines, fields)
+        else:
+            if records is None:
+                records = line_records(batch_record, lines, fields)
+            for record in records:
+                handler.handle(record)
@@ -0,0 +1,62 @@
+import os
+import socket
+import subprocess
+
+
+def server_dir(prefix):
+    """Directory of the wineserver socket of a prefix, as computed by wineserver"""
+    st = os.stat(prefix)
+    return "/tmp/.wine-{}/server-{:x}-{:x}".format(os.getuid(), st.st_dev, st.st_ino)
+
+
+def server_running(prefix):
+    """Check whether a wineserver accepts connections for the prefix"""
+    try:
+        path = os.path.join(server_dir(prefix), "socket")
+    except OSError:
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def persist_option(persist):
+    """wineserver -p option for a persistence setting, seconds or "infinite" """
+    return "-p" if persist == "infinite" else "-p{}".format(persist)
+
+
+def start_server(wine_env, persist, wrapper=()):
+    """Start a persistent wineserver for the prefix of wine_env
+
+    wineserver forks into the background once it holds the prefix lock, so
+    this returns when the server is ready. Returns False if it failed.
+    """
+    result = subprocess.run(list(wrapper) + [wine_env['WINESERVER'], persist_option(persist)],
+                            env=wine_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+def ensure_server(log, wine_env, persist, wrapper=()):
+    """Reuse the running wineserver of the prefix, or start a persistent one"""
+    prefix = wine_env['WINEPREFIX']
+    if not os.path.isdir(prefix):
+        log.debug("Prefix {} not created yet, leaving wineserver startup to WINE".format(prefix))
+        return
+    if server_running(prefix):
+        log.info("Reusing running wineserver for {}".format(prefix))
+    elif start_server(wine_env, persist, wrapper):
+        log.info("Started wineserver for {} (persistence {})".format(prefix, persist))
+    else:
+        log.warning("Cannot start wineserver {}".format(wine_env['WINESERVER']))
+
+
+def stop_server(wine_env):
+    """Kill the wineserver of the prefix and its processes"""
+    result = subprocess.run([wine_env['WINESERVER'], "-k"], env=wine_env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
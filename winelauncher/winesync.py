@@ -0,0 +1,99 @@
+import resource
+
+# futex_waitv syscall number, the same on every architecture
+FUTEX_WAITV = 449
+# esync keeps an eventfd open per synchronization object
+ESYNC_NOFILE = 524288
+SYNC_VARIABLES = {"esync": "WINEESYNC", "fsync": "WINEFSYNC"}
+
+_host_fsync = None
+
+
+def host_fsync():
+    """Check whether the kernel provides futex_waitv, needed by fsync"""
+    global _host_fsync
+    if _host_fsync is None:
+        import ctypes
+        import errno
+        libc = ctypes.CDLL(None, use_errno=True)
+        # Without arguments, a kernel with futex_waitv fails with EINVAL
+        result = libc.syscall(FUTEX_WAITV, None, 0, 0, None, 0)
+        _host_fsync = result == 0 or ctypes.get_errno() != errno.ENOSYS
+    return _host_fsync
+
+
+def raise_nofile():
+    """Raise the soft RLIMIT_NOFILE of the launcher, inherited by WINE, up to the hard limit
+
+    Returns the soft limit.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return soft
+    wanted = max(soft, ESYNC_NOFILE) if hard == resource.RLIM_INFINITY else hard
+    if wanted > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+            soft = wanted
+        except (OSError, ValueError):
+            pass
+    return soft
+
+
+def esync_nofile(plan):
+    """Whether WINE gets enough file descriptors for esync
+
+    An rlimit_nofile setting replaces the limit WINE inherits from the
+    launcher, so it is the one checked, capped as the launcher will apply it.
+    """
+    limits = (plan.get('tuning') or {}).get('rlimits', {}).get('RLIMIT_NOFILE')
+    if limits:
+        from winelauncher.tuning import capped_rlimit
+        soft = capped_rlimit('RLIMIT_NOFILE', *limits)[0]
+    else:
+        soft = raise_nofile()
+    return soft == resource.RLIM_INFINITY or soft >= ESYNC_NOFILE
+
+
+def select_sync(log, plan, wine_env):
+    """Choose the synchronization mode of a launch and set WINEFSYNC/WINEESYNC in wine_env
+
+    Variables already set by the environment or the config file are kept.
+    """
+    supported = plan['sync']
+    preset = {name: wine_env[variable] for name, variable in SYNC_VARIABLES.items()
+              if variable in wine_env}
+    if preset:
+        if preset.get("esync", "0") != "0" and not esync_nofile(plan):
+            log.warning("RLIMIT_NOFILE of WINE below {}, esync may fail".format(ESYNC_NOFILE))
+        log.info("Sync mode set by the environment: {}".format(
+            ", ".join("{}={}".format(SYNC_VARIABLES[name], value)
+                      for name, value in sorted(preset.items()))))
+        return
+
+    mode = plan['sync_mode']
+    if mode == "auto":
+        if "fsync" in supported and host_fsync():
+            mode = "fsync"
+        elif "esync" in supported and esync_nofile(plan):
+            mode = "esync"
+        else:
+            if "esync" in supported:
+                log.warning("RLIMIT_NOFILE of WINE below {} (hard limit or rlimit_nofile), "
+                            "not using esync".format(ESYNC_NOFILE))
+            mode = "none"
+    elif mode != "none":
+        if mode not in supported:
+            log.warning("WINE build {} does not support {}".format(plan['wine_base'], mode))
+            mode = "none"
+        elif mode == "fsync" and not host_fsync():
+            log.warning("The kernel lacks futex_waitv, fsync may not work")
+
+    if mode == "fsync":
+        wine_env["WINEFSYNC"] = "1"
+    if mode == "esync" or (mode == "fsync" and "esync" in supported):
+        # fsync builds fall back to esync when the kernel lacks futex_waitv
+        wine_env["WINEESYNC"] = "1"
+        if not esync_nofile(plan):
+            log.warning("RLIMIT_NOFILE of WINE below {}, esync may fail".format(ESYNC_NOFILE))
+    log.info("Sync mode: {} (build supports {})".format(mode, ", ".join(supported) or "none"))
@@ -0,0 +1,124 @@
+import os
+import re
+import threading
+import time
+
+from winelauncher.cache import cache_dir, read_json, write_json
+
+WINETRICKS_LOG = "winetricks.log"
+# Winetricks commands that are not verbs: the command line is run as given
+COMMANDS = {"list", "list-all", "list-cached", "list-download", "list-manual-download",
+            "list-installed", "apps", "dlls", "fonts", "settings", "help", "annihilate"}
+# Settings verbs change a value back and forth, they are always run: the
+# name=value settings and the windows versions (not the winhttp/wininet verbs)
+SETTING_RE = re.compile(r"=|^(win(20|30|31|95|98|me|2k|2k3|2k8|2k8r2|xp|7|8|81|10|11)"
+                        r"|vista|nt351|nt40)$")
+# Seconds between two checks of winetricks.log while winetricks runs
+POLL_INTERVAL = 0.25
+
+
+def applied_verbs(prefix):
+    """Verbs winetricks recorded as applied to a prefix"""
+    try:
+        with open(os.path.join(prefix, WINETRICKS_LOG), errors="replace") as tricks_log:
+            return {line.strip() for line in tricks_log if line.strip()}
+    except OSError:
+        return set()
+
+
+def timings_path():
+    return os.path.join(cache_dir(), "winetricks.json")
+
+
+def verb_times():
+    """Seconds the latest run of each verb took, in any prefix"""
+    return read_json(timings_path(), {}).get("verbs", {})
+
+
+def setup_winetricks(log, wine_exec, wine_env, download_cache, force=False):
+    """Share the download cache and drop the verbs already applied to the prefix
+
+    Returns the winetricks command left to run, None when every verb was
+    already applied.
+    """
+    os.makedirs(download_cache, exist_ok=True)
+    wine_env.setdefault('W_CACHE', download_cache)
+
+    options = [arg for arg in wine_exec[1:] if arg.startswith("-")]
+    verbs = [arg for arg in wine_exec[1:] if not arg.startswith("-")]
+    if force and "--force" not in options:
+        options.append("--force")
+    if "--force" in options or not verbs or COMMANDS.intersection(verbs):
+        return wine_exec[:1] + options + verbs
+
+    applied = applied_verbs(wine_env['WINEPREFIX'])
+    skipped = [verb for verb in verbs if verb in applied and not SETTING_RE.search(verb)]
+    if skipped:
+        times = verb_times()
+        saved = sum(times.get(verb, 0) for verb in skipped)
+        log.info("Skipping winetricks verbs already applied: {} ({:.1f} s saved)".format(
+            ", ".join("{} ({})".format(verb, "{:.1f} s".format(times[verb]) if verb in times
+                                       else "time unknown") for verb in skipped), saved))
+    verbs = [verb for verb in verbs if verb not in skipped]
+    if not verbs:
+        return None
+    return wine_exec[:1] + options + verbs
+
+
+class VerbTimer:
+    """Time each verb of a winetricks run from the lines it appends to winetricks.log"""
+
+    def __init__(self, prefix, interval=POLL_INTERVAL):
+        self.path = os.path.join(prefix, WINETRICKS_LOG)
+        self.interval = interval
+        self.offset = self.size()
+        self.pending = b""
+        self.times = {}
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def start(self):
+        self.last = time.monotonic()
+        self.thread.start()
+
+    def poll(self):
+        if self.size() <= self.offset:
+            return
+        try:
+            with open(self.path, "rb") as tricks_log:
+                tricks_log.seek(self.offset)
+                data = self.pending + tricks_log.read()
+        except OSError:
+            return
+        self.offset += len(data) - len(self.pending)
+        lines = data.split(b"\n")
+        self.pending = lines.pop()
+        now = time.monotonic()
+        for line in lines:
+            verb = line.decode("utf-8", "replace").strip()
+            if verb:
+                self.times[verb] = round(now - self.last, 1)
+                self.last = now
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        """Stop polling, saving and returning the time of each verb applied"""
+        self.stopped.set()
+        self.thread.join()
+        self.poll()
+        if self.times:
+            path = timings_path()
+            verbs = read_json(path, {}).get("verbs", {})
+            verbs.update(self.times)
+            write_json(path, {"verbs": verbs})
+        return self.times